@@ -1,13 +1,26 @@
 # neo4j-admin database load --from-path="neo4j.dump文件所在目录" --overwrite-destination=true neo4j --verbose
 import os
-import re
-import jieba
+import time
+import atexit
+import json
+import queue
+import hashlib
 import logging
+import argparse
+import resource
+import threading
+import numpy as np
+import multiprocessing
+from pathlib import Path
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from neo4j import GraphDatabase
-from sentence_transformers import SentenceTransformer
+from embed_client import EMBED_SERVICE_MODEL, get_embed_client
+from tokenization import build_user_dict, dictionary_version, get_tokenizer, tokenize_many
+from vector_mirror import export_vector_mirror, mirror_dir
 from neo4j_graphrag.indexes import (
     create_vector_index,
-    upsert_vectors,
     create_fulltext_index,
 )
 
@@ -20,8 +33,44 @@ if not logger.handlers:
     handler.setFormatter(formatter)
     logger.addHandler(handler)
 
+# 需要建立索引的节点标签及其文本属性
+index_targets = [
+    ("Category1", "category1_name"),
+    ("Category2", "category2_name"),
+    ("Category3", "category3_name"),
+    ("Trademark", "trademark_name"),
+    ("SPU", "spu_name"),
+    ("SKU", "sku_name"),
+    ("Attr", "attr_value"),
+]
+
 vector_dim = 768  # 嵌入向量维度
-embed_batch_size = 64  # 嵌入向量计算批次大小
+insert_batch_size = 1000  # 全文索引每个写事务的节点数
+# 向量写入每个事务的节点数：从初始值开始，按提交耗时在上下限之间自适应调整
+vector_write_chunk = 500
+vector_write_chunk_min = 50
+vector_write_chunk_max = 5000
+vector_write_target_s = 0.5  # 单个向量写事务的目标提交耗时（秒）
+read_page_size = 5000  # 读取游标每批拉取的节点数，也是流水线中每页（检查点、每批计算）的节点数
+pipeline_queue_size = 4  # 流水线各阶段之间队列的最大页数，控制内存占用
+write_workers = 2  # 每个索引任务并发写入 Neo4j 的线程数
+neo4j_write_concurrency = 4  # 并行模式下所有进程、所有任务同时写入 Neo4j 的事务数上限
+# 去重缓存：每个任务最多记住的不同文本数（向量每条约 3KB，分词结果很小）
+embedding_memo_size = 20000
+fulltext_memo_size = 200000
+tokenize_processes = os.cpu_count()  # 全文索引分词的进程数，并行模式下子进程内改为 1
+# 检查点目录：每个索引任务（向量/全文 × 标签）一个文件，记录已提交的最后一页 elementId
+checkpoint_dir = Path(__file__).resolve().parent.parent / "output" / "index_checkpoints"
+resume = False  # --resume：从检查点继续，已完成的任务跳过
+# --report / --dry-run 的报告目录
+report_dir = Path(__file__).resolve().parent.parent / "output" / "index_report"
+dry_run_sample_size = 1000  # --dry-run 每个标签抽样的节点数
+# 内容哈希的盐：模型或分词规则（领域词典）变化后，哈希随之变化，增量模式会重新计算所有节点
+embedding_hash_salt = EMBED_SERVICE_MODEL
+
+
+def fulltext_hash_salt():
+    return f"jieba-{dictionary_version()}"
 
 
 def drop_constraint(driver):
@@ -39,12 +88,393 @@ def drop_index_without_constraint(driver):
             driver.execute_query(f"drop index {record['name']} if exists")
 
 
+# 按 elementId 写入嵌入向量（向量类型属性）和内容哈希
+vector_write_query = (
+    "UNWIND $rows AS row "
+    "MATCH (n) "
+    "WHERE elementId(n) = row.id "
+    "SET n.embedding_hash = row.hash "
+    "WITH n, row "
+    "CALL db.create.setNodeVectorProperty(n, 'embedding', row.embedding) "
+    "RETURN count(n) AS written"
+)
+# 按 elementId 写入全文索引属性和内容哈希
+fulltext_write_query = (
+    "UNWIND $rows AS row " #将传入的rows列表（通过参数传递）展开，每一项作为一行数据，命名为row
+    "MATCH (n) "
+    "WHERE elementId(n) = row.id "
+    "SET n.fulltext = row.fulltext, n.fulltext_hash = row.hash "
+)
+
+
+def content_hash(text, salt):
+    """节点索引属性的内容哈希，存放在节点上用于判断是否需要重新计算"""
+    return hashlib.sha1(f"{salt}\0{text}".encode()).hexdigest()
+
+
+def read_pages(driver, label, property, target, hash_property, salt, start_id=""):
+    """
+    读取需要（重新）计算 target 属性的节点：target 缺失，或存储的内容哈希与当前文本不一致。
+    全量重建时 target 已被清空，所有节点都会被选中；增量模式下只返回新增或文本变化的节点。
+    整个标签只执行一次查询（按 elementId 排序，从大于 start_id 的节点开始），结果以 read_page_size 为批逐批拉取，
+    不再每页重新扫描、排序整个标签；每 read_page_size 个节点生成一次
+    (本页最后一个 elementId, [(elementId, 文本, 新哈希)])，跳过没有待计算节点的页
+    """
+    with driver.session(fetch_size=read_page_size) as session:
+        result = session.run(
+            f"""match (n:{label}) where n.{property} is not null and elementId(n) > $last_id
+                return elementId(n) as id, n.{property} as text,
+                       n.{target} is null as missing, n.{hash_property} as hash
+                order by id""",
+            {"last_id": start_id},
+        )
+        pending, seen = [], 0
+        for r in result:
+            new_hash = content_hash(r["text"], salt)
+            if r["missing"] or r["hash"] != new_hash:
+                pending.append((r["id"], r["text"], new_hash))
+            seen += 1
+            if seen == read_page_size:
+                if pending:
+                    yield r["id"], pending
+                pending, seen = [], 0
+        if pending:
+            yield r["id"], pending
+
+
+_STOP = object()  # 流水线结束标记
+_write_slots = None  # 跨进程共享的写入信号量，None 表示不限制
+
+
+def limit_writes(slots):
+    """设置全局写入信号量，run_pipeline 的每次写入都要先取得一个名额"""
+    global _write_slots
+    _write_slots = slots
+
+
+@contextmanager
+def write_slot():
+    if _write_slots is None:
+        yield
+        return
+    with _write_slots:
+        yield
+
+
+def run_pipeline(
+    pages, transform, write, on_commit=None, writers=write_workers, queue_size=pipeline_queue_size
+):
+    """
+    读取 -> 计算 -> 写入 三段流水线，各阶段在独立线程中并发执行，阶段之间用有界队列衔接：
+        pages: 逐页生成 (页标记, 待计算节点) 的迭代器（读取阶段）
+        transform: 计算一页，返回交给写入阶段的批次
+        write: 写入一个批次，返回写入的节点数；writers 个线程并发写入
+        on_commit(页标记, 已提交节点数): 某页及其之前的所有页都写入后调用，用于记录检查点
+    多个写入线程可能乱序完成，只有连续写入完成的前缀才会提交。
+    任一阶段出错时停止其余阶段并在调用线程中抛出。返回写入的节点总数
+    """
+    read_queue = queue.Queue(queue_size)
+    write_queue = queue.Queue(queue_size)
+    stop = threading.Event()
+    errors = []
+    written = [0]
+    lock = threading.Lock()
+    finished = {}  # 页序号 -> (页标记, 节点数)：已写入但前面还有未写入的页
+    watermark = [0, 0]  # [下一个待提交的页序号, 已提交节点数]
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _STOP
+
+    def read():
+        for seq, (key, page) in enumerate(pages):
+            if not put(read_queue, (seq, key, page)):
+                return
+        put(read_queue, _STOP)
+
+    def compute():
+        while (item := get(read_queue)) is not _STOP:
+            seq, key, page = item
+            if not put(write_queue, (seq, key, transform(page))):
+                return
+        for _ in range(writers):
+            put(write_queue, _STOP)
+
+    def store():
+        while (item := get(write_queue)) is not _STOP:
+            seq, key, batch = item
+            with write_slot():
+                count = write(batch)
+            with lock:
+                written[0] += count
+                finished[seq] = (key, count)
+                committed_key = None
+                while watermark[0] in finished:
+                    committed_key, committed_count = finished.pop(watermark[0])
+                    watermark[0] += 1
+                    watermark[1] += committed_count
+                if committed_key is not None and on_commit:
+                    on_commit(committed_key, watermark[1])
+
+    def guarded(stage):
+        def run():
+            try:
+                stage()
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+        return run
+
+    threads = [threading.Thread(target=guarded(read)), threading.Thread(target=guarded(compute))]
+    threads += [threading.Thread(target=guarded(store)) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+    return written[0]
+
+
+def checkpoint_path(target, label):
+    return checkpoint_dir / f"{target}-{label}.json"
+
+
+def load_checkpoint(target, label, salt):
+    """读取检查点；内容哈希的盐（模型/词典）已变化时检查点作废"""
+    path = checkpoint_path(target, label)
+    if not path.exists():
+        return None
+    checkpoint = json.loads(path.read_text())
+    if checkpoint.get("salt") != salt:
+        logger.info(f"{path.name} 的模型或分词词典已变化，忽略检查点")
+        return None
+    return checkpoint
+
+
+def save_checkpoint(target, label, **checkpoint):
+    """写入检查点，先写临时文件再替换，进程中途退出也不会留下写了一半的文件"""
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    path = checkpoint_path(target, label)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(checkpoint, ensure_ascii=False))
+    os.replace(tmp, path)
+
+
+def clear_checkpoints():
+    for path in checkpoint_dir.glob("*.json"):
+        path.unlink()
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB），进程级的历史最大值，不区分同一进程中的各个任务"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class JobStats:
+    """单个索引任务的耗时统计，流水线各阶段线程共用；--report 时汇总输出"""
+
+    def __init__(self, target, label):
+        self.target = target
+        self.label = label
+        self.nodes = 0
+        self.distinct_texts = 0
+        self.read_s = 0.0
+        self.compute_s = 0.0
+        self.write_s = 0.0
+        self.transactions = 0
+        self.wall_s = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, **values):
+        with self.lock:
+            for key, value in values.items():
+                setattr(self, key, getattr(self, key) + value)
+
+    def as_dict(self):
+        return {
+            "target": self.target,
+            "label": self.label,
+            "nodes": self.nodes,
+            "distinct_texts": self.distinct_texts,
+            "read_s": round(self.read_s, 3),
+            "compute_s": round(self.compute_s, 3),
+            "texts_per_s": round(self.distinct_texts / self.compute_s, 1) if self.compute_s else None,
+            "write_s": round(self.write_s, 3),
+            "transactions": self.transactions,
+            "wall_s": round(self.wall_s, 3),
+            # 任务结束时所在进程的峰值 RSS（只增不减；--jobs 时同一进程内并发的任务共用）
+            "process_peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+
+
+def run_job(driver, label, property, target, salt, transform, write, name, stats):
+    """
+    执行一个索引任务：分页读取 target 缺失或内容哈希变化的节点，经流水线计算并写入，
+    每提交一页记录一次检查点；resume 时从检查点的 elementId 继续，已完成的任务直接跳过。
+    读取、计算、写入各阶段的耗时累计到 stats（各阶段并发，总耗时接近最慢的阶段而不是三者之和）
+    """
+    checkpoint = load_checkpoint(target, label, salt) if resume else None
+    if checkpoint and checkpoint["done"]:
+        logger.info(f"{label} 的{name}已完成（检查点），跳过")
+        return
+    start_id = checkpoint["last_id"] if checkpoint else ""
+    previous = checkpoint["written"] if checkpoint else 0
+    if checkpoint:
+        logger.info(f"{label} 的{name}从检查点继续，此前已写入 {previous}")
+
+    def commit(last_id, count):
+        save_checkpoint(
+            target, label, last_id=last_id, written=previous + count, salt=salt, done=False
+        )
+
+    def timed_pages():
+        start = time.perf_counter()
+        for item in read_pages(driver, label, property, target, f"{target}_hash", salt, start_id):
+            stats.add(read_s=time.perf_counter() - start)
+            yield item
+            start = time.perf_counter()
+
+    def timed(stage, key):
+        def run(item):
+            start = time.perf_counter()
+            result = stage(item)
+            stats.add(**{key: time.perf_counter() - start})
+            return result
+        return run
+
+    logger.info(f"计算并写入 {label} 的{name}")
+    start = time.perf_counter()
+    count = run_pipeline(
+        timed_pages(), timed(transform, "compute_s"), timed(write, "write_s"), on_commit=commit
+    )
+    stats.add(nodes=count, wall_s=time.perf_counter() - start)
+    save_checkpoint(
+        target, label, last_id=None, written=previous + count, salt=salt, done=True
+    )
+    if count:
+        logger.info(f"写入 {label} ({count}) 的{name}")
+    else:
+        logger.info(f"{label} 所有节点的{name}皆为最新")
+
+
+def normalize_text(text):
+    """去重用的规范化文本：去掉首尾空白，连续空白合并为一个空格"""
+    return " ".join(text.split())
+
+
+class TextMemo:
+    """
+    按规范化文本去重：一页中相同的文本只计算一次，跨页重复的文本（如 Attr 的“黑色”“128GB”）直接复用之前的结果。
+    compute 接收不重复的文本列表，返回同样顺序的结果；缓存为有界 LRU，流水线线程间共用
+    """
+
+    def __init__(self, compute, max_size):
+        self.compute = compute
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, texts):
+        keys = [normalize_text(text) for text in texts]
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key in self.cache:
+                    found[key] = self.cache[key]
+                    self.cache.move_to_end(key)
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        computed = dict(zip(missing, self.compute(missing))) if missing else {}
+        with self.lock:
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+            self.cache.update(computed)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+        return [found[key] if key in found else computed[key] for key in keys]
+
+    def log(self, label, name):
+        if self.hits:
+            logger.info(f"{label} 的{name}去重：{self.misses} 个不同文本，复用 {self.hits} 次")
+
+
 # --------- 创建向量索引 ---------
-embed_model = SentenceTransformer("../models/bge-base-zh-v1.5")
+class ChunkSizer:
+    """
+    按观察到的提交耗时调整每个写事务的节点数，同一任务的多个写入线程共用：
+    提交耗时不到目标一半时翻倍，超过目标时按比例缩小，始终限制在 [min_size, max_size] 内
+    """
+
+    def __init__(self, size, min_size, max_size, target_s):
+        self.size = size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_s = target_s
+        self.lock = threading.Lock()
+
+    def observe(self, size, elapsed):
+        with self.lock:
+            if elapsed > self.target_s:
+                new_size = int(size * self.target_s / elapsed)
+            elif elapsed < self.target_s / 2 and size >= self.size:
+                new_size = size * 2
+            else:
+                return
+            self.size = max(self.min_size, min(self.max_size, new_size))
+
+
+def write_vectors(driver, ids, embeddings, hashes, sizer):
+    """
+    按 elementId 分事务写入嵌入向量和内容哈希，每个事务的节点数由 sizer 决定：
+    UNWIND 展开一批行，db.create.setNodeVectorProperty 以向量类型存储属性。返回事务数
+    """
+    i = 0
+    transactions = 0
+    while i < len(ids):
+        size = sizer.size
+        rows = [
+            {"id": ids[j], "embedding": embeddings[j].tolist(), "hash": hashes[j]}
+            for j in range(i, min(i + size, len(ids)))
+        ]
+        start = time.perf_counter()
+        driver.execute_query(vector_write_query, {"rows": rows})
+        sizer.observe(len(rows), time.perf_counter() - start)
+        i += len(rows)
+        transactions += 1
+    return transactions
+
+
+# 嵌入向量由嵌入服务计算（与检索使用同一模型后端），本进程不加载模型。
+# 客户端首次使用时创建，并行模式下所有向量任务共用同一个连接池
+embed_client = None
+_embed_client_lock = threading.Lock()
+
+
+def get_client():
+    global embed_client
+    with _embed_client_lock:
+        if embed_client is None:
+            embed_client = get_embed_client()
+        return embed_client
 
 
 def vector_indexing(driver, label, property="name"):
-    """创建向量索引，并添加嵌入向量"""
+    """创建向量索引（已存在则保留），为缺失或文本变化的节点添加嵌入向量"""
 
     # 创建向量索引
     create_vector_index(
@@ -56,39 +486,38 @@ def vector_indexing(driver, label, property="name"):
         similarity_fn="cosine",  # 向量相似度函数，可选值为 "euclidean"（欧几里得距离）或 "cosine"（余弦相似度）
     )
 
-    # 查询 embedding 为 null 的节点，获取 elementId 和 指定属性
-    record_list = driver.execute_query(
-        f"""match (n:{label}) where n.embedding is null
-            return elementId(n) as id, n.{property} as text""",
-    ).records
-    record_tuple_list = [(r["id"], r["text"]) for r in record_list]
-    if not record_tuple_list:
-        logger.info(f"{label} 所有节点皆存在嵌入向量")
-        return
-    # [('id1', 'text1'), ('id2', 'text2')] =》 zip(('id1', 'text1'), ('id2', 'text2'))=>[('id1', 'id2'), ('text1', 'text2')]
-    ids, texts = zip(*record_tuple_list)
-    ids = list(ids)
-    texts = list(texts)
-
-    # 计算文本的嵌入向量
-    logger.info(f"计算 {label} ({len(record_list)}) 的嵌入向量")
-    embeddings = embed_model.encode(
-        texts, batch_size=embed_batch_size, normalize_embeddings=True
+    # 相同文本只编码一次，结果按行复制给所有节点（行向量单独拷贝，不让整批结果常驻缓存）
+    memo = TextMemo(
+        lambda texts: [row.copy() for row in get_client().encode(texts)], embedding_memo_size
     )
 
-    # 按 elementId 添加嵌入向量属性
-    logger.info(f"写入 {label} ({len(record_list)}) 的嵌入向量")
-    upsert_vectors(
-        driver,
-        ids=ids,
-        embedding_property="embedding",
-        embeddings=embeddings,
+    def encode(page):
+        # [('id1', 'text1', 'h1'), ('id2', 'text2', 'h2')] =》 [('id1', 'id2'), ('text1', 'text2'), ('h1', 'h2')]
+        ids, texts, hashes = zip(*page)
+        return list(ids), memo(texts), list(hashes)
+
+    sizer = ChunkSizer(
+        vector_write_chunk, vector_write_chunk_min, vector_write_chunk_max, vector_write_target_s
     )
 
+    stats = JobStats("embedding", label)
+
+    def write(batch):
+        # 按 elementId 分事务添加嵌入向量属性
+        ids, embeddings, hashes = batch
+        stats.add(transactions=write_vectors(driver, ids, embeddings, hashes, sizer))
+        return len(ids)
+
+    # 分页读取 embedding 缺失或内容哈希变化的节点，读取、计算嵌入向量、写入三个阶段并发执行
+    run_job(driver, label, property, "embedding", embedding_hash_salt, encode, write, "嵌入向量", stats)
+    memo.log(label, "嵌入向量")
+    stats.distinct_texts = memo.misses
+    return stats.as_dict()
+
 
 # --------- 创建全文索引 ---------
 def fulltext_indexing(driver, label, property="name"):
-    """创建全文索引，并添加节点属性"""
+    """创建全文索引（已存在则保留），为缺失或文本变化的节点添加全文索引属性"""
 
     # 创建全文索引
     create_fulltext_index(
@@ -98,89 +527,356 @@ def fulltext_indexing(driver, label, property="name"):
         node_properties=["fulltext"],  # 要创建全文索引的节点属性列表
     )
 
-    # 查询 fulltext 为 null 的节点，获取 elementId 和 指定属性
-    record_list = driver.execute_query(
-        f"""match (n:{label}) where n.fulltext is null
-            return elementId(n) as id, n.{property} as text""",
-    ).records
-    record_tuple_list = [(r["id"], r["text"]) for r in record_list]
-    if not record_tuple_list:
-        logger.info(f"{label} 所有节点皆存在全文索引属性")
-        return
+    # 文本分词（领域词典，大批量时多进程），只保留中英文和数字；相同文本只分词一次
+    memo = TextMemo(lambda texts: tokenize_many(texts, tokenize_processes), fulltext_memo_size)
 
-    # 文本分词，作为全文索引属性
-    logger.info(f"计算 {label} ({len(record_list)}) 的全文索引")
-    pattern = re.compile(r"[a-zA-Z0-9\u4e00-\u9fa5]+") #匹配英文字母、数字和中文字符
-    fulltext_tuple_list = [
-        (
-            id_,
-            " ".join(
-                [
-                    word.strip()
-                    for word in jieba.lcut(text)
-                    if pattern.fullmatch(word.strip())#过滤掉不符合正则表达式的词汇
-                ]
-            ),
-        )
-        for id_, text in record_tuple_list
+    stats = JobStats("fulltext", label)
+
+    def tokenize(page):
+        # 分词结果作为全文索引属性
+        words_list = memo([text for _, text, _ in page])
+        return [
+            {"id": id_, "hash": hash_, "fulltext": " ".join(words)}
+            for (id_, _, hash_), words in zip(page, words_list)
+        ]
+
+    def write(rows):
+        # 按 elementId 添加全文索引属性
+        for i in range(0, len(rows), insert_batch_size):
+            # UNWIND：将列表数据展开为多行记录
+            driver.execute_query(fulltext_write_query, {"rows": rows[i: i + insert_batch_size]})
+            stats.add(transactions=1)
+        return len(rows)
+
+    # 分页读取 fulltext 缺失或内容哈希变化的节点，读取、分词、写入三个阶段并发执行
+    run_job(
+        driver, label, property, "fulltext", fulltext_hash_salt(), tokenize, write, "全文索引属性", stats
+    )
+    memo.log(label, "全文索引属性")
+    stats.distinct_texts = memo.misses
+    return stats.as_dict()
+
+
+# --------- 并行构建 ---------
+_worker_driver = None  # 子进程各自的 Neo4j 连接
+
+
+def _init_worker(neo4j_url, neo4j_auth, slots, resume_from_checkpoint):
+    global _worker_driver, tokenize_processes, resume
+    limit_writes(slots)
+    resume = resume_from_checkpoint
+    tokenize_processes = 1  # 已按标签多进程并行，子进程内不再开分词进程池
+    _worker_driver = GraphDatabase.driver(neo4j_url, auth=neo4j_auth)
+    atexit.register(_worker_driver.close)
+
+
+def _fulltext_job(label, property):
+    return fulltext_indexing(_worker_driver, label, property)
+
+
+def parallel_indexing(driver, neo4j_url, neo4j_auth, jobs):
+    """
+    各标签的向量/全文索引任务互不依赖，并发执行：
+        全文索引（jieba 分词，CPU 密集）在 jobs 个子进程中执行，每个子进程一个 Neo4j 连接；
+        向量索引在当前进程的线程中执行，共用同一个嵌入服务客户端（连接池）；
+    所有进程的写事务共用一个信号量，同时写入 Neo4j 的事务数不超过 neo4j_write_concurrency。
+    返回各任务的统计
+    """
+    ctx = multiprocessing.get_context("spawn")
+    slots = ctx.BoundedSemaphore(neo4j_write_concurrency)
+    limit_writes(slots)
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        mp_context=ctx,
+        initializer=_init_worker,
+        initargs=(neo4j_url, neo4j_auth, slots, resume),
+    ) as processes, ThreadPoolExecutor(max_workers=min(jobs, len(index_targets))) as threads:
+        futures = {}
+        for label, property in index_targets:
+            futures[processes.submit(_fulltext_job, label, property)] = f"{label} 全文索引"
+            futures[threads.submit(vector_indexing, driver, label, property)] = f"{label} 向量索引"
+        results = []
+        for future in as_completed(futures):
+            results.append(future.result())  # 任务出错时直接抛出
+            logger.info(f"{futures[future]} 完成")
+    return results
+
+
+# --------- 统计报告 ---------
+def write_report(rows, name, columns, summary=None):
+    """
+    将统计结果写入 report_dir/{name}.json 和 {name}.md：
+        columns: [(字段, 表头)]，Markdown 表格按此顺序输出
+        summary: 附加在 JSON 和 Markdown 末尾的汇总信息
+    """
+    report_dir.mkdir(parents=True, exist_ok=True)
+    (report_dir / f"{name}.json").write_text(
+        json.dumps({"jobs": rows, "summary": summary or {}}, ensure_ascii=False, indent=2)
+    )
+    lines = [
+        "| " + " | ".join(header for _, header in columns) + " |",
+        "|" + "---|" * len(columns),
     ]
-    ids, fulltexts = zip(*fulltext_tuple_list)
-    ids = list(ids)
-    fulltexts = list(fulltexts)
-
-    # 按 elementId 添加全文索引属性
-    logger.info(f"写入 {label} ({len(fulltexts)}) 的全文索引")
-    insert_batch_size = 1000
-    for i in range(0, len(record_tuple_list), insert_batch_size):
-        batch_rows = [
-            {"id": id_, "fulltext": ft}
-            for id_, ft in zip(
-                ids[i: i + insert_batch_size],
-                fulltexts[i: i + insert_batch_size],
-            )
+    for row in rows:
+        lines.append("| " + " | ".join(str(row.get(key, "")) for key, _ in columns) + " |")
+    if summary:
+        lines.append("")
+        lines.extend(f"- {key}: {value}" for key, value in summary.items())
+    (report_dir / f"{name}.md").write_text("\n".join(lines) + "\n")
+    logger.info(f"报告已写入 {report_dir / name}.json / .md")
+
+
+build_report_columns = [
+    ("target", "任务"),
+    ("label", "标签"),
+    ("nodes", "节点数"),
+    ("distinct_texts", "不同文本数"),
+    ("read_s", "读取(s)"),
+    ("compute_s", "计算(s)"),
+    ("texts_per_s", "文本/s"),
+    ("write_s", "写入(s)"),
+    ("transactions", "事务数"),
+    ("wall_s", "总耗时(s)"),
+    ("process_peak_rss_mb", "所在进程峰值RSS(MB)"),
+]
+
+dry_run_columns = [
+    ("label", "标签"),
+    ("nodes", "节点数"),
+    ("sample", "样本数"),
+    ("distinct_ratio", "不同文本比例"),
+    ("est_embed_s", "预计编码(s)"),
+    ("est_tokenize_s", "预计分词(s)"),
+    ("est_write_s", "预计写入(s)"),
+    ("est_serial_s", "串行合计(s)"),
+    ("est_pipelined_s", "流水线(s)"),
+]
+
+
+def dry_run(driver, sample_size=dry_run_sample_size):
+    """
+    估算全量重建的耗时，不修改任何数据：每个标签取前 sample_size 个节点，
+    实际调用嵌入服务编码、分词，并在事务中执行同样的写入语句后回滚，按节点数线性外推。
+    嵌入客户端默认请求 cache=false，服务跳过目录向量表和缓存，编码耗时测的是模型推理而不是查表
+    （设置了 EMBED_CLIENT_USE_CACHE=1 时估算会偏乐观）。
+    样本内的重复率低于全量（重复文本跨页出现），编码/分词的估算偏保守。
+    """
+    # 先加载分词词典、建立到嵌入服务的连接，不计入估算
+    get_tokenizer()
+    get_client().encode(["预热"])
+    rows = []
+    for label, property in index_targets:
+        count = driver.execute_query(
+            f"match (n:{label}) where n.{property} is not null return count(n) as count"
+        ).records[0]["count"]
+        records = driver.execute_query(
+            f"""match (n:{label}) where n.{property} is not null
+                return elementId(n) as id, n.{property} as text limit $sample_size""",
+            {"sample_size": sample_size},
+        ).records
+        if not records:
+            continue
+        texts = [normalize_text(r["text"]) for r in records]
+        distinct = list(dict.fromkeys(texts))
+
+        start = time.perf_counter()
+        vectors = dict(zip(distinct, get_client().encode(distinct)))
+        embed_s = time.perf_counter() - start
+        start = time.perf_counter()
+        words = dict(zip(distinct, tokenize_many(distinct, tokenize_processes)))
+        tokenize_s = time.perf_counter() - start
+
+        # 写入耗时：在事务中执行写入语句，计时后回滚
+        vector_rows = [
+            {"id": r["id"], "embedding": vectors[t].tolist(), "hash": ""}
+            for r, t in zip(records, texts)
         ]
+        fulltext_rows = [
+            {"id": r["id"], "fulltext": " ".join(words[t]), "hash": ""}
+            for r, t in zip(records, texts)
+        ]
+        with driver.session() as session:
+            tx = session.begin_transaction()
+            try:
+                start = time.perf_counter()
+                tx.run(vector_write_query, rows=vector_rows).consume()
+                tx.run(fulltext_write_query, rows=fulltext_rows).consume()
+                write_s = time.perf_counter() - start
+            finally:
+                tx.rollback()
 
-        # UNWIND：将列表数据展开为多行记录
+        scale = count / len(records)
+        estimate = {
+            "label": label,
+            "nodes": count,
+            "sample": len(records),
+            "distinct_ratio": round(len(distinct) / len(records), 3),
+            "est_embed_s": round(embed_s * scale, 1),
+            "est_tokenize_s": round(tokenize_s * scale, 1),
+            "est_write_s": round(write_s * scale, 1),
+        }
+        stages = [estimate["est_embed_s"], estimate["est_tokenize_s"], estimate["est_write_s"]]
+        estimate["est_serial_s"] = round(sum(stages), 1)
+        estimate["est_pipelined_s"] = round(max(stages), 1)
+        rows.append(estimate)
+        logger.info(f"{label} 预计：{estimate}")
+    return rows
 
-        driver.execute_query(
-            "UNWIND $rows AS row " #将传入的rows列表（通过参数传递）展开，每一项作为一行数据，命名为row
-            "MATCH (n) "
-            "WHERE elementId(n) = row.id "
-            "SET n.fulltext = row.fulltext ",
-            {"rows": batch_rows},
-        )
+
+# --------- 导出目录向量表 ---------
+def export_catalog_table(driver, out_dir):
+    """
+    将所有已索引节点的 (文本 -> 嵌入向量) 导出为 float32 行矩阵 + 文本哈希索引，
+    嵌入服务设置 EMBED_CATALOG_DIR 后，精确命中的目录名称直接查表，不再调用模型。
+    先写临时文件再替换，避免服务读到写了一半的表。
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    vector_tmp = out_dir / "vectors.f32.tmp"
+    index_tmp = out_dir / "index.txt.tmp"
+    seen = set()
+    rows = 0
+    with open(vector_tmp, "wb") as vf, open(index_tmp, "w") as xf, driver.session() as session:
+        for label, property in index_targets:
+            # 逐条流式读取，不把整个标签的向量读入内存
+            result = session.run(
+                f"""match (n:{label}) where n.embedding is not null and n.{property} is not null
+                    return n.{property} as text, n.embedding as embedding"""
+            )
+            label_rows = 0
+            for record in result:
+                key = hashlib.sha1(record["text"].encode()).hexdigest()
+                if key in seen:  # 相同文本只保留一行
+                    continue
+                seen.add(key)
+                vf.write(np.asarray(record["embedding"], dtype="<f4").tobytes())
+                xf.write(f"{key} {rows}\n")
+                rows += 1
+                label_rows += 1
+            logger.info(f"导出 {label} ({label_rows}) 的目录向量")
+
+    # 记录请求的模型注册名，嵌入服务按同一名称匹配（未登记的名称在服务端回退到默认模型，不会匹配）
+    meta = {"model": EMBED_SERVICE_MODEL, "dim": vector_dim, "rows": rows}
+    os.replace(vector_tmp, out_dir / "vectors.f32")
+    os.replace(index_tmp, out_dir / "index.txt")
+    (out_dir / "meta.json").write_text(json.dumps(meta, ensure_ascii=False))
+    logger.info(f"目录向量表已导出到 {out_dir}，共 {rows} 条")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="构建 Neo4j 向量/全文索引")
+    parser.add_argument(
+        "--export-catalog",
+        metavar="DIR",
+        help="只导出目录向量表（文本 -> 向量）到 DIR，供嵌入服务 EMBED_CATALOG_DIR 使用，不重建索引",
+    )
+    parser.add_argument(
+        "--export-mirror",
+        action="store_true",
+        help="只导出检索进程内的向量镜像（elementId -> 向量），不重建索引",
+    )
+    parser.add_argument(
+        "--vector-mirror",
+        action="store_true",
+        help="构建完成后导出向量镜像（检索端启用了 vector_mirror 时使用）；没有写入任何嵌入向量且镜像已存在时跳过",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="增量模式：保留现有索引和属性，只为新增或文本变化（内容哈希不一致）的节点重新计算",
+    )
+    parser.add_argument(
+        "--rebuild-dict",
+        action="store_true",
+        help="增量/续跑时也重新生成分词领域词典（词典变化后所有节点的全文索引属性都会重新计算）",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="从上次中断处继续：不清空任何索引和属性，已完成的任务跳过，未完成的从检查点记录的最后一页继续",
+    )
+    parser.add_argument(
+        "--report",
+        action="store_true",
+        help=f"记录每个标签的节点数、不同文本数、各阶段耗时、事务数和所在进程的峰值内存，写入 {report_dir}/build_report.json/.md",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help=f"只抽样估算全量重建耗时，不修改任何数据，结果写入 {report_dir}/dry_run.json/.md",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="并行任务数：大于 1 时各标签的向量/全文索引并发构建（全文索引使用进程池），默认 1 逐个构建",
+    )
+    args = parser.parse_args()
+
     neo4j_url = "neo4j://127.0.0.1"
     neo4j_auth = ("neo4j", "deyong123456")
     with GraphDatabase.driver(neo4j_url, auth=neo4j_auth) as driver:
-        # 1、清空处理：确保所有索引和约束都被清理干净，为后续重新创建索引做好准备
-        # 清空所有约束。约束会自动创建索引，删除约束同时会删除对应的索引
-        drop_constraint(driver)
-        # 清空所有没有约束的索引
-        drop_index_without_constraint(driver)
-
-        # 2、清空并创建向量索引
-        # 清空所有嵌入向量
-        driver.execute_query("match (n) remove n.embedding")
-        # 创建向量索引
-        vector_indexing(driver, "Category1", "category1_name")
-        vector_indexing(driver, "Category2", "category2_name")
-        vector_indexing(driver, "Category3", "category3_name")
-        vector_indexing(driver, "Trademark", "trademark_name")
-        vector_indexing(driver, "SPU", "spu_name")
-        vector_indexing(driver, "SKU", "sku_name")
-        vector_indexing(driver, "Attr", "attr_value")
-
-        # 3、清空并创建全文索引
-        # 清空所有节点全文索引属性
-        driver.execute_query("match (n) remove n.fulltext")
-        # 创建全文索引
-        fulltext_indexing(driver, "Category1", "category1_name")
-        fulltext_indexing(driver, "Category2", "category2_name")
-        fulltext_indexing(driver, "Category3", "category3_name")
-        fulltext_indexing(driver, "Trademark", "trademark_name")
-        fulltext_indexing(driver, "SPU", "spu_name")
-        fulltext_indexing(driver, "SKU", "sku_name")
-        fulltext_indexing(driver, "Attr", "attr_value")
+        if args.export_catalog:
+            export_catalog_table(driver, args.export_catalog)
+            raise SystemExit(0)
+        if args.export_mirror:
+            export_vector_mirror(driver, [label for label, _ in index_targets], EMBED_SERVICE_MODEL, vector_dim)
+            raise SystemExit(0)
+        if args.dry_run:
+            write_report(dry_run(driver), "dry_run", dry_run_columns)
+            raise SystemExit(0)
+
+        resume = args.resume
+        if not resume:
+            clear_checkpoints()
+        # 续跑和增量模式都不清空已有索引和属性
+        rebuild = not (args.incremental or resume)
+
+        if rebuild:
+            # 1、清空处理：确保所有索引和约束都被清理干净，为后续重新创建索引做好准备
+            # 清空所有约束。约束会自动创建索引，删除约束同时会删除对应的索引
+            drop_constraint(driver)
+            # 清空所有没有约束的索引
+            drop_index_without_constraint(driver)
+
+        # 根据当前图谱中的品牌、SPU、分类名称重新生成分词领域词典
+        # 续跑和增量模式沿用已有词典：词典内容是全文索引哈希的盐，几乎任何新品牌/SPU 都会改变词典，
+        # 使所有标签的全文索引属性过期而全部重新分词（续跑时还会使检查点作废）；需要时用 --rebuild-dict 显式重建
+        if rebuild or args.rebuild_dict or dictionary_version() == "default":
+            build_user_dict(driver)
+
+        # 2、清空嵌入向量和全文索引属性（增量模式不清空，按内容哈希只更新变化的节点）
+        if rebuild:
+            driver.execute_query("match (n) remove n.embedding")
+            driver.execute_query("match (n) remove n.fulltext")
+
+        build_start = time.perf_counter()
+        if args.jobs > 1:
+            # 3、并发创建各标签的向量索引和全文索引
+            results = parallel_indexing(driver, neo4j_url, neo4j_auth, args.jobs)
+        else:
+            # 3、创建向量索引
+            results = [vector_indexing(driver, label, property) for label, property in index_targets]
+            # 4、创建全文索引
+            results += [fulltext_indexing(driver, label, property) for label, property in index_targets]
+
+        # 5、导出向量镜像并更新版本标记，启用了 vector_mirror 的检索进程检测到后重新加载
+        # 每次导出都是所有标签的全量向量，没有写入任何嵌入向量（如无变化的增量同步）时沿用已有镜像
+        if args.vector_mirror:
+            written = sum(r["nodes"] for r in results if r and r["target"] == "embedding")
+            if written or not (mirror_dir / "version.json").exists():
+                export_vector_mirror(driver, [label for label, _ in index_targets], EMBED_SERVICE_MODEL, vector_dim)
+            else:
+                logger.info("没有写入嵌入向量，向量镜像保持不变")
+
+        if args.report:
+            write_report(
+                [r for r in results if r],
+                "build_report",
+                build_report_columns,
+                {
+                    "总耗时(s)": round(time.perf_counter() - build_start, 1),
+                    "并行任务数": args.jobs,
+                    "主进程峰值RSS(MB)": round(peak_rss_mb(), 1),
+                },
+            )
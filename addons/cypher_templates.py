@@ -0,0 +1,201 @@
+"""
+Cypher 模板快速通道：常见问题形态直接由路由结果（标签 + 实体）和检索到的入口节点填充参数化 Cypher，
+跳过 LLM 生成、验证、校正三步。
+    - 某分类下的商品                  Category → SPU
+    - 某品牌（某分类下）的商品         Trademark (+ Category) → SPU
+    - 具有属性 X、Y 的单品             Attr+ (+ Category / Trademark / SPU) → SKU
+    - 当前用户浏览过/购买过的单品      User + 关键词 (+ 上述条件) → SKU
+图谱的关系类型和方向不写死，连接时从 Neo4jGraph.structured_schema 的 relationships 中按标签查找最短路径；
+找不到路径、出现不支持的标签或问题涉及价格、比较等模板无法回答的内容时不匹配，仍走 LLM 生成。
+混合检索的融合得分按最高分归一化，排第一的节点得分总是接近 1，不能说明实体真的存在（“小米”会检索到“华为”），
+因此入口节点必须与实体文本匹配（entity_matches）才能用于模板。
+"""
+
+from collections import Counter, deque
+
+try:
+    from addons.semantic_cache import normalize_query
+except ImportError:  # 在 addons 目录下直接运行时
+    from semantic_cache import normalize_query
+
+category_labels = ("Category1", "Category2", "Category3")
+# 节点标签 -> 名称属性
+name_properties = {
+    "Category1": "category1_name",
+    "Category2": "category2_name",
+    "Category3": "category3_name",
+    "Trademark": "trademark_name",
+    "SPU": "spu_name",
+    "SKU": "sku_name",
+    "Attr": "attr_value",
+}
+# 用户与商品关系的意图：问题关键词 -> 关系类型名称中的关键词
+user_intents = {
+    "viewed": (("看过", "看到过", "浏览", "看了"), ("VIEW", "BROWSE", "VISIT", "浏览")),
+    "bought": (("买过", "购买", "买的", "下单", "下过单"), ("BUY", "BOUGHT", "ORDER", "PURCHASE", "购买")),
+}
+# 模板只返回商品列表，涉及这些内容的问题交给 LLM 生成
+unsupported_keywords = ("价格", "多少钱", "便宜", "贵", "销量", "评价", "评论", "比较", "对比", "区别", "库存")
+result_limit = 50
+# 实体包含节点名称时，多出的部分含有这些字说明是否定（“非有机食品”不能匹配“有机食品”）
+negation_chars = "非不无没"
+
+
+def entity_matches(entity, name):
+    """
+    实体与检索到的节点名称在文本上是否匹配（规范化后）：相同，名称包含实体（“mate40” -> “华为mate40pro”），
+    或实体包含名称且多出的部分不含否定词（“华为手机” -> “华为”）；被包含的一方至少 2 个字符，“蓝”不能匹配“蓝色”
+    """
+    entity, name = normalize_query(entity), normalize_query(str(name))
+    if not entity or not name:
+        return False
+    if entity == name:
+        return True
+    if min(len(entity), len(name)) < 2:
+        return False
+    if entity in name:
+        return True
+    return name in entity and not any(c in entity.replace(name, "", 1) for c in negation_chars)
+
+
+class SchemaPaths:
+    """按 structured_schema 的关系定义，在标签之间查找最短路径并生成 Cypher 模式"""
+
+    def __init__(self, relationships):
+        self.relationships = relationships
+        self.edges = {}  # 标签 -> [(关系类型, 方向, 相邻标签)]
+        for rel in relationships:
+            self.edges.setdefault(rel["start"], []).append((rel["type"], "->", rel["end"]))
+            self.edges.setdefault(rel["end"], []).append((rel["type"], "<-", rel["start"]))
+
+    def path(self, start, end, max_hops=3):
+        """广度优先查找 start 到 end 的最短路径，返回 [(关系类型, 方向, 下一个标签)]，找不到返回 None"""
+        queue = deque([(start, [])])
+        visited = {start}
+        while queue:
+            label, steps = queue.popleft()
+            if label == end and steps:
+                return steps
+            if len(steps) >= max_hops:
+                continue
+            for rel_type, direction, neighbor in self.edges.get(label, []):
+                if neighbor == end or neighbor not in visited:
+                    visited.add(neighbor)
+                    queue.append((neighbor, steps + [(rel_type, direction, neighbor)]))
+        return None
+
+    def pattern(self, start_var, start, end_var, end):
+        """生成 (start_var:start)-[:R]->(:X)<-[:S]-(end_var:end) 形式的模式，找不到路径返回 None"""
+        steps = self.path(start, end)
+        if steps is None:
+            return None
+        text = f"({start_var}:{start})"
+        for i, (rel_type, direction, label) in enumerate(steps):
+            node = f"({end_var}:{label})" if i == len(steps) - 1 else f"(:{label})"
+            text += f"-[:{rel_type}]->{node}" if direction == "->" else f"<-[:{rel_type}]-{node}"
+        return text
+
+    def user_relation(self, intent, target):
+        """User 与 target 之间名称符合意图关键词的直接关系，返回 (关系类型, 方向)"""
+        keywords = user_intents[intent][1]
+        for rel_type, direction, neighbor in self.edges.get("User", []):
+            if neighbor == target and any(k.lower() in rel_type.lower() for k in keywords):
+                return rel_type, direction
+        return None
+
+
+class TemplateMatcher:
+    """
+    按路由结果匹配模板：
+        route_res: route_label 的输出（标签 + 实体）
+        top_matches: {(标签, 实体): 与实体文本匹配的得分最高的节点名称}，由 node_retrieval 填充
+    匹配成功返回 (模板名称, Cypher, 参数)，否则返回 None；stats 记录各模板命中次数，用于统计覆盖率
+    """
+
+    def __init__(self, relationships):
+        self.schema = SchemaPaths(relationships)
+        self.stats = Counter()
+
+    def match(self, query, route_res, top_matches, user_id):
+        result = self._match(query, route_res, top_matches, user_id)
+        self.stats[result[0] if result else "llm"] += 1
+        return result
+
+    def coverage(self):
+        total = sum(self.stats.values())
+        return (total - self.stats["llm"]) / total if total else 0.0
+
+    def _match(self, query, route_res, top_matches, user_id):
+        if any(k in query for k in unsupported_keywords):
+            return None
+        items = [i for i in route_res if i.entity]
+        if not items:
+            return None
+
+        # 按标签归类实体对应的入口节点名称
+        slots = {}
+        for item in items:
+            if item.label == "User":
+                slots.setdefault("User", []).append(item.entity)
+                continue
+            if item.label not in name_properties:
+                return None
+            name = top_matches.get((item.label, item.entity))
+            if name is None:  # 实体没有检索到节点
+                return None
+            slots.setdefault(item.label, []).append(name)
+        categories = [(label, slots[label]) for label in category_labels if label in slots]
+        if len(categories) > 1 or any(len(names) > 1 for _, names in categories):
+            return None
+        if any(len(slots.get(label, [])) > 1 for label in ("Trademark", "SPU", "SKU", "User")):
+            return None
+        if "SKU" in slots:  # 问的是具体单品，交给 LLM
+            return None
+
+        intent = None
+        if "User" in slots:
+            intent = next(
+                (name for name, (words, _) in user_intents.items() if any(w in query for w in words)),
+                None,
+            )
+            if intent is None or str(slots["User"][0]) != str(user_id):
+                return None
+
+        # 有属性、SPU 或用户行为条件时查单品，否则查商品
+        target = "SKU" if ("Attr" in slots or "SPU" in slots or intent) else "SPU"
+        var = "k" if target == "SKU" else "s"
+        clauses, params, shape = [], {}, []
+
+        if intent:
+            relation = self.schema.user_relation(intent, target)
+            if relation is None:
+                return None
+            rel_type, direction = relation
+            arrow = f"-[:{rel_type}]->" if direction == "->" else f"<-[:{rel_type}]-"
+            clauses.append(f"MATCH (u:User){arrow}({var}:{target}) WHERE u.user_id = $user_id")
+            params["user_id"] = int(slots["User"][0])
+            shape.append(f"user_{intent}")
+
+        conditions = [(label, name) for label, names in categories for name in names]
+        conditions += [("Trademark", name) for name in slots.get("Trademark", [])]
+        conditions += [("SPU", name) for name in slots.get("SPU", [])]
+        conditions += [("Attr", name) for name in slots.get("Attr", [])]
+        for i, (label, name) in enumerate(conditions):
+            pattern = self.schema.pattern(var, target, f"n{i}", label)
+            if pattern is None:
+                return None
+            clauses.append(f"MATCH {pattern} WHERE n{i}.{name_properties[label]} = $p{i}")
+            params[f"p{i}"] = name
+            shape.append("category" if label in category_labels else label.lower())
+        if not clauses:
+            return None
+
+        # 附带品牌，便于回答“都是什么品牌的”
+        returns = [f"{var}.{name_properties[target]} AS {name_properties[target]}"]
+        brand = self.schema.pattern(var, target, "t", "Trademark")
+        if brand:
+            clauses.append(f"OPTIONAL MATCH {brand}")
+            returns.append("t.trademark_name AS trademark_name")
+        clauses.append(f"RETURN DISTINCT {', '.join(returns)} LIMIT {result_limit}")
+        name = "+".join(dict.fromkeys(shape)) + f"->{target}"
+        return name, "\n".join(clauses), params
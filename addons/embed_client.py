@@ -0,0 +1,180 @@
+"""
+嵌入向量客户端：索引构建和检索测试通过 HTTP 调用嵌入服务（embed_service.py），
+与 Rasa 检索使用同一个模型后端，调用方进程不再加载模型。
+    - requests.Session 长连接池，多个请求并发
+    - 文本按 batch_size 分批，base64 传输，结果按原始顺序拼接
+    - 429/503/504 和连接错误自动重试，429/503 遵循服务返回的 Retry-After
+    - 默认请求 cache=false：服务跳过目录向量表和缓存，由模型实际编码（索引构建不能写回旧向量）
+    - 配置了 EMBED_LOCAL_FALLBACK（本地模型路径）时，服务不可用才降级为进程内编码
+
+环境变量：
+    EMBED_SERVICE_URL: 嵌入服务地址，默认 http://localhost:10010
+    EMBED_SERVICE_MODEL: 请求的模型名称，默认 bge-base-zh-v1.5
+    EMBED_CLIENT_BATCH_SIZE: 每个请求的文本数，默认 256
+    EMBED_CLIENT_CONCURRENCY: 同时在途的请求数（连接池大小），默认 4
+    EMBED_CLIENT_RETRIES: 每个请求的最大重试次数，默认 5
+    EMBED_CLIENT_TIMEOUT: 单个请求超时秒数，默认 60
+    EMBED_CLIENT_USE_CACHE: 是否允许服务用目录向量表/缓存应答，默认 0（不允许）
+    EMBED_LOCAL_FALLBACK: 本地模型路径，默认空（不降级，服务不可用时直接报错）
+"""
+
+import os
+import time
+import base64
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("embed_client")
+
+EMBED_SERVICE_URL = os.getenv("EMBED_SERVICE_URL", "http://localhost:10010")
+EMBED_SERVICE_MODEL = os.getenv("EMBED_SERVICE_MODEL", "bge-base-zh-v1.5")
+EMBED_CLIENT_BATCH_SIZE = int(os.getenv("EMBED_CLIENT_BATCH_SIZE", "256"))
+EMBED_CLIENT_CONCURRENCY = int(os.getenv("EMBED_CLIENT_CONCURRENCY", "4"))
+EMBED_CLIENT_RETRIES = int(os.getenv("EMBED_CLIENT_RETRIES", "5"))
+EMBED_CLIENT_TIMEOUT = float(os.getenv("EMBED_CLIENT_TIMEOUT", "60"))
+EMBED_CLIENT_USE_CACHE = os.getenv("EMBED_CLIENT_USE_CACHE", "0") == "1"
+EMBED_LOCAL_FALLBACK = os.getenv("EMBED_LOCAL_FALLBACK", "")
+
+retry_status = {429, 502, 503, 504}  # 过载、未就绪、超时，稍后重试
+
+
+class EmbedServiceError(RuntimeError):
+    """嵌入服务重试后仍不可用"""
+
+
+class EmbedClient:
+    """嵌入服务客户端，线程安全，多个索引任务可共用一个实例"""
+
+    def __init__(
+        self,
+        base_url=EMBED_SERVICE_URL,
+        model=EMBED_SERVICE_MODEL,
+        batch_size=EMBED_CLIENT_BATCH_SIZE,
+        concurrency=EMBED_CLIENT_CONCURRENCY,
+        retries=EMBED_CLIENT_RETRIES,
+        timeout=EMBED_CLIENT_TIMEOUT,
+        use_cache=EMBED_CLIENT_USE_CACHE,
+    ):
+        self.url = base_url.rstrip("/") + "/embeddings"
+        self.model = model
+        self.batch_size = batch_size
+        self.retries = retries
+        self.timeout = timeout
+        self.use_cache = use_cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def _post(self, texts):
+        """请求一批文本的向量，失败时按 Retry-After 或指数退避重试"""
+        error = None
+        for attempt in range(self.retries + 1):
+            delay = min(2 ** attempt * 0.5, 30)
+            try:
+                response = self.session.post(
+                    self.url,
+                    json={
+                        "model": self.model,
+                        "input": texts,
+                        "encoding_format": "base64",
+                        "cache": self.use_cache,
+                    },
+                    timeout=self.timeout,
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if response.status_code not in retry_status:
+                    if not response.ok:  # 其他错误不重试，同样按服务不可用处理（可降级为本地编码）
+                        raise EmbedServiceError(f"HTTP {response.status_code}: {response.text[:200]}")
+                    data = sorted(response.json()["data"], key=lambda item: item["index"])
+                    return np.stack(
+                        [np.frombuffer(base64.b64decode(item["embedding"]), dtype="<f4") for item in data]
+                    )
+                error = EmbedServiceError(f"HTTP {response.status_code}: {response.text[:200]}")
+                delay = float(response.headers.get("Retry-After", delay))
+            if attempt < self.retries:
+                logger.warning(f"嵌入服务请求失败，{delay:.1f}s 后重试（{attempt + 1}/{self.retries}）：{error}")
+                time.sleep(delay)
+        raise EmbedServiceError(f"嵌入服务不可用：{error}") from error
+
+    def encode(self, texts):
+        """编码文本，返回与 texts 顺序一致的 float32 矩阵（已归一化）"""
+        texts = list(texts)
+        batches = [texts[i: i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if not batches:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.concatenate(list(self.executor.map(self._post, batches)))
+
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
+
+
+class LocalEmbedClient:
+    """进程内编码，接口与 EmbedClient 一致；模型在首次编码时加载"""
+
+    def __init__(self, model_path, max_batch_tokens=8192, max_batch_size=64):
+        self.model_path = model_path
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self._model = None
+        self._lock = threading.Lock()
+
+    def encode(self, texts):
+        from token_batching import encode_by_token_budget
+
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+
+                logger.info(f"加载本地嵌入模型 {self.model_path}")
+                self._model = SentenceTransformer(self.model_path)
+        return encode_by_token_budget(
+            self._model,
+            list(texts),
+            self.max_batch_tokens,
+            normalize_embeddings=True,
+            max_batch_size=self.max_batch_size,
+        ).astype(np.float32, copy=False)
+
+    def close(self):
+        pass
+
+
+class FallbackEmbedClient:
+    """优先调用嵌入服务，服务重试后仍不可用时改用本地模型，之后不再请求服务"""
+
+    def __init__(self, service, local):
+        self.service = service
+        self.local = local
+        self.model = service.model
+        self.use_local = False
+
+    def encode(self, texts):
+        if not self.use_local:
+            try:
+                return self.service.encode(texts)
+            except EmbedServiceError as e:
+                logger.warning(f"{e}，降级为本地编码（{self.local.model_path}）")
+                self.use_local = True
+        return self.local.encode(texts)
+
+    def close(self):
+        self.service.close()
+        self.local.close()
+
+
+def get_embed_client():
+    """按环境变量创建客户端：默认只调用嵌入服务，配置 EMBED_LOCAL_FALLBACK 时允许降级为本地编码"""
+    client = EmbedClient()
+    if EMBED_LOCAL_FALLBACK:
+        return FallbackEmbedClient(client, LocalEmbedClient(EMBED_LOCAL_FALLBACK))
+    return client
@@ -1,10 +1,32 @@
 """提供嵌入模型服务接口，方便 rasa 中调用该 Embedding 模型。"""
 
+import time
+
+_process_start = time.perf_counter()
+
+import gc
 import os
+import json
+import fcntl
+import shutil
+import base64
+import asyncio
+import hashlib
+import functools
+import itertools
+import threading
+from typing import Literal
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import FastAPI
+import numpy as np
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from sentence_transformers import SentenceTransformer
+from token_batching import encode_by_token_budget
+
+_import_seconds = time.perf_counter() - _process_start
 
 # 支持通过环境变量配置模型路径/名称，默认优先本项目内的 models 目录，不存在则回退到 HuggingFace 名称
 ENV_MODEL = os.getenv("EMBED_MODEL_PATH")
@@ -18,60 +40,1191 @@ PRIMARY_MODEL_ID = str(Path(ENV_MODEL).expanduser()) if ENV_MODEL else next(
 )
 FALLBACK_MODEL_ID = os.getenv("EMBED_MODEL_FALLBACK", "BAAI/bge-base-zh-v1.5")
 
+# 推理后端：torch（默认）、onnx、onnx-int8（动态 int8 量化），ONNX 需安装 optimum[onnxruntime]
+BACKEND = os.getenv("EMBED_BACKEND", "torch").lower()
+ONNX_QUANT_CONFIG = os.getenv("EMBED_ONNX_QCONFIG", "avx2")  # 量化指令集：arm64/avx2/avx512/avx512_vnni
+# 导出的 ONNX 模型缓存目录，默认放在项目 models 目录下
+ONNX_CACHE_DIR = Path(
+    os.getenv("EMBED_ONNX_DIR", Path(__file__).resolve().parent.parent / "models")
+).expanduser()
+# 一致性校验：ONNX 向量与 torch 向量的余弦相似度下限
+PARITY_MIN_COS = float(os.getenv("EMBED_PARITY_MIN_COS", "0.98"))
+# 代表性商品文本，用于一致性校验和启动预热
+SAMPLE_TEXTS = [
+    "华为", "手机", "256GB", "白色", "蓝色", "70英寸", "非有机食品", "香水彩妆",
+    "家用电器", "索芙特", "华为Mate 40 pro", "iPhone 16 Pro",
+    "联想（Lenovo） 拯救者Y9000P 2022 16英寸游戏笔记本电脑 i9-12900H RTX3070Ti 钛晶灰",
+    "有没有带保湿功能的润唇膏，都是什么品牌的",
+]
+
+# 微批处理配置：并发请求在等待窗口内合并为一次 encode 调用
+BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))  # 最长等待时间(毫秒)
+BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "64"))  # 单次合并的最大文本数
+# 单个前向批次 padding 后的 token 总数上限（批大小 × 批内最长长度）
+BATCH_MAX_TOKENS = int(os.getenv("EMBED_MAX_BATCH_TOKENS", "8192"))
+# 流式接口每攒够多少条记录编码并返回一次
+STREAM_BATCH_SIZE = int(os.getenv("EMBED_STREAM_BATCH_SIZE", "256"))
+
+# 准入控制：在途请求数/在途文本数上限，超过则直接返回 429；请求默认超时（毫秒，0 表示不限）
+MAX_INFLIGHT_REQUESTS = int(os.getenv("EMBED_MAX_INFLIGHT_REQUESTS", "256"))
+MAX_INFLIGHT_TEXTS = int(os.getenv("EMBED_MAX_INFLIGHT_TEXTS", "4096"))
+REQUEST_TIMEOUT_MS = float(os.getenv("EMBED_REQUEST_TIMEOUT_MS", "0"))
+RETRY_AFTER_S = int(os.getenv("EMBED_RETRY_AFTER_S", "1"))
+
+# 多进程配置：worker 数量，以及每个 worker 的 torch / onnxruntime 计算线程数（0 表示按 CPU 核数平均分配）
+WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+WORKER_THREADS = int(os.getenv("EMBED_WORKER_THREADS", "0"))
+
+# 向量缓存配置：内存 LRU 条目上限，以及可选的磁盘缓存目录（为空则不启用磁盘层）
+CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_SIZE", "20000"))
+CACHE_DIR = os.getenv("EMBED_CACHE_DIR")
+# 全量商品目录向量表目录（由 create_indexing.py --export-catalog 导出），精确命中时不调用模型
+CATALOG_DIR = os.getenv("EMBED_CATALOG_DIR")
+NORMALIZE_EMBEDDINGS = True  # 服务端统一输出归一化向量
+
+# 多模型注册表：默认模型以 EMBED_DEFAULT_MODEL 为名常驻；EMBED_MODELS 登记其他模型，形如
+# "bge-small-zh=BAAI/bge-small-zh-v1.5,name2=/path/to/model"，按请求中的 model 名称首次使用时加载
+DEFAULT_MODEL_NAME = os.getenv("EMBED_DEFAULT_MODEL", "bge-base-zh-v1.5")
+EXTRA_MODELS = os.getenv("EMBED_MODELS", "")
+MAX_RESIDENT_MODELS = int(os.getenv("EMBED_MAX_MODELS", "2"))  # 同时常驻的模型数上限
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("EMBED_MODEL_MEMORY_MB", "0"))  # 常驻模型内存预算，0 表示不限
+
+
+def check_parity(model, reference_model_id: str, samples=SAMPLE_TEXTS) -> dict:
+    """用样例文本比较 model 与 torch 参考模型的输出，返回余弦相似度的最小值/均值"""
+    reference = SentenceTransformer(reference_model_id)
+    expected = reference.encode(samples, normalize_embeddings=True)
+    actual = model.encode(samples, normalize_embeddings=True)
+    cos = np.sum(expected * actual, axis=1)
+    return {"min_cos": float(cos.min()), "mean_cos": float(cos.mean())}
+
+
+def verify_parity(model, reference_model_id: str):
+    parity = check_parity(model, reference_model_id)
+    print(f"[embed_service] Parity vs torch: {parity}")
+    if parity["min_cos"] < PARITY_MIN_COS:
+        raise RuntimeError(
+            f"ONNX 模型与 torch 输出不一致：min_cos={parity['min_cos']:.4f} < {PARITY_MIN_COS}"
+        )
+
+
+def export_onnx_model(model_name: str, export_dir: Path, quantize: bool):
+    """
+    导出 ONNX 模型到 export_dir（只需执行一次），可选再导出动态 int8 量化版本。
+    每个产物通过一致性校验后才保留，校验失败不会留下不可用的缓存。
+    """
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    if not (export_dir / "onnx" / "model.onnx").exists():
+        start = time.perf_counter()
+        print(f"[embed_service] Exporting ONNX model: {model_name} -> {export_dir}")
+        tmp_dir = export_dir.with_name(export_dir.name + ".tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        onnx_model = SentenceTransformer(model_name, backend="onnx")
+        onnx_model.save_pretrained(str(tmp_dir))
+        verify_parity(onnx_model, model_name)
+        tmp_dir.rename(export_dir)
+        print(f"[embed_service] ONNX export took {time.perf_counter() - start:.1f}s")
+
+    if quantize:
+        print(f"[embed_service] Quantizing ONNX model ({ONNX_QUANT_CONFIG})")
+        onnx_model = SentenceTransformer(str(export_dir), backend="onnx")
+        export_dynamic_quantized_onnx_model(
+            onnx_model, ONNX_QUANT_CONFIG, str(export_dir)
+        )
+        quantized_file = export_dir / onnx_file_name(quantize)
+        try:
+            verify_parity(load_onnx_model(export_dir, quantize), model_name)
+        except Exception:
+            quantized_file.unlink(missing_ok=True)
+            raise
+
+
+def onnx_file_name(quantize: bool) -> str:
+    return f"onnx/model_qint8_{ONNX_QUANT_CONFIG}.onnx" if quantize else "onnx/model.onnx"
 
-def load_model():
+
+# onnxruntime 会话的 intra-op 线程数，0 表示由 onnxruntime 决定；多 worker 模式下由 run_worker 设置
+onnx_threads = WORKER_THREADS
+
+
+def load_onnx_model(export_dir: Path, quantize: bool):
+    model_kwargs = {"file_name": onnx_file_name(quantize)}
+    if onnx_threads:
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = onnx_threads
+        model_kwargs["session_options"] = options
+    return SentenceTransformer(str(export_dir), backend="onnx", model_kwargs=model_kwargs)
+
+
+def onnx_export_dir(model_name: str) -> Path:
+    return ONNX_CACHE_DIR / f"{Path(model_name).name}-onnx"
+
+
+def build_model(model_name: str):
+    """按 EMBED_BACKEND 构建模型，ONNX 后端优先使用 models 下已导出的缓存"""
+    if BACKEND == "torch":
+        return SentenceTransformer(model_name)
+    if BACKEND not in ("onnx", "onnx-int8"):
+        raise ValueError(f"不支持的 EMBED_BACKEND: {BACKEND}")
+    quantize = BACKEND == "onnx-int8"
+    export_dir = onnx_export_dir(model_name)
+    if not (export_dir / onnx_file_name(quantize)).exists():
+        export_onnx_model(model_name, export_dir, quantize)
+    return load_onnx_model(export_dir, quantize)
+
+
+def load_model(model_name: str, fallback: str | None = None):
+    """加载模型，返回实际加载的模型ID（非 torch 后端带后端后缀，用于区分缓存）与模型"""
+    suffix = "" if BACKEND == "torch" else f"#{BACKEND}"
     try:
-        print(f"[embed_service] Loading model: {PRIMARY_MODEL_ID}")
-        return SentenceTransformer(PRIMARY_MODEL_ID)
+        print(f"[embed_service] Loading model: {model_name} (backend={BACKEND})")
+        return model_name + suffix, build_model(model_name)
     except FileNotFoundError:
-        if PRIMARY_MODEL_ID == FALLBACK_MODEL_ID:
+        if not fallback or model_name == fallback:
             raise
         print(
-            f"[embed_service] Primary model not found: {PRIMARY_MODEL_ID}, "
-            f"fallback to: {FALLBACK_MODEL_ID}"
+            f"[embed_service] Primary model not found: {model_name}, "
+            f"fallback to: {fallback}"
+        )
+        return fallback + suffix, build_model(fallback)
+
+
+def rss_bytes() -> int | None:
+    """当前进程常驻内存（仅 Linux 可用）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+
+def model_memory_bytes(model, rss_before: int | None) -> int:
+    """估算模型占用内存：torch 模型按参数与缓冲区大小计算，其他后端按加载前后的 RSS 差值"""
+    try:
+        import torch
+
+        if isinstance(model, torch.nn.Module):
+            size = sum(
+                t.numel() * t.element_size()
+                for t in itertools.chain(model.parameters(), model.buffers())
+            )
+            if size:
+                return size
+    except ImportError:
+        pass
+    rss_after = rss_bytes()
+    if rss_before is None or rss_after is None:
+        return 0
+    return max(0, rss_after - rss_before)
+
+
+# 默认模型在后台线程中加载，加载并预热完成前 /readyz 返回 503
+startup = {"ready": False, "error": None, "timings": {"import_s": _import_seconds}}
+
+
+class DiskEmbeddingStore:
+    """
+    磁盘缓存层：向量按行追加写入 float32 文件，读取时通过 memmap 映射，索引文件记录“key 行号”。
+    重启后可直接复用；写入时加文件锁，多个进程可共享同一目录。
+    """
+
+    def __init__(self, directory: str | Path, dim: int):
+        self.directory = Path(directory).expanduser()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.row_bytes = dim * 4
+        self.vector_path = self.directory / "vectors.f32"
+        self.index_path = self.directory / "index.txt"
+        self.index: dict[str, int] = {}
+        self._index_offset = 0  # 已读取的索引文件字节数
+        self._mmap = None
+
+        meta_path = self.directory / "meta.json"
+        if meta_path.exists():
+            meta = json.loads(meta_path.read_text())
+            if meta["dim"] != dim:
+                raise ValueError(
+                    f"缓存目录 {self.directory} 的向量维度为 {meta['dim']}，与模型维度 {dim} 不一致"
+                )
+        else:
+            meta_path.write_text(json.dumps({"dim": dim}))
+        self.vector_path.touch()
+        self.index_path.touch()
+        self.refresh()
+
+    def __len__(self):
+        return len(self.index)
+
+    def refresh(self):
+        """读取索引文件中新增的记录（可能由其他进程写入）"""
+        if self.index_path.stat().st_size == self._index_offset:
+            return
+        n_rows = self.vector_path.stat().st_size // self.row_bytes
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_offset)
+            data = f.read()
+        # 只处理完整的行，写了一半的行留到下次读取
+        data = data[: data.rfind(b"\n") + 1]
+        self._index_offset += len(data)
+        for line in data.decode().splitlines():
+            key, row = line.split()
+            if int(row) < n_rows:  # 忽略向量未完整落盘的记录
+                self.index[key] = int(row)
+
+    def get(self, key: str) -> np.ndarray | None:
+        row = self.index.get(key)
+        if row is None:
+            return None
+        if self._mmap is None or row >= len(self._mmap):
+            n_rows = self.vector_path.stat().st_size // self.row_bytes
+            self._mmap = np.memmap(
+                self.vector_path, dtype="<f4", mode="r", shape=(n_rows, self.dim)
+            )
+        return np.array(self._mmap[row])
+
+    def put_many(self, keys: list[str], vectors: np.ndarray):
+        if not keys:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype="<f4")
+        with open(self.vector_path, "ab") as vf, open(self.index_path, "a") as xf:
+            fcntl.flock(xf, fcntl.LOCK_EX)
+            try:
+                # 行号以加锁后的文件长度为准，保证多进程并发追加时索引与向量对齐
+                start = os.fstat(vf.fileno()).st_size // self.row_bytes
+                vf.write(vectors.tobytes())
+                vf.flush()
+                xf.write("".join(f"{k} {start + i}\n" for i, k in enumerate(keys)))
+                xf.flush()
+            finally:
+                fcntl.flock(xf, fcntl.LOCK_UN)
+        for i, k in enumerate(keys):
+            self.index[k] = start + i
+
+
+class EmbeddingCache:
+    """
+    内容寻址的向量缓存，key 为 (模型ID, 是否归一化, 文本哈希)。
+    第一层为有上限的内存 LRU，第二层为可选的磁盘缓存，两层都未命中的文本才交给模型计算。
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        normalize: bool,
+        max_entries: int,
+        disk: DiskEmbeddingStore | None = None,
+    ):
+        self.prefix = f"{model_id}\0{int(normalize)}\0".encode()
+        self.max_entries = max_entries
+        self.disk = disk
+        self.memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()  # 启用磁盘层时在线程池中读写，需串行化
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, text: str) -> str:
+        return hashlib.sha1(self.prefix + text.encode()).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def get_many(self, texts: list[str]) -> list[np.ndarray | None]:
+        """依次查询内存层、磁盘层，未命中的位置返回 None"""
+        with self._lock:
+            return self._get_many(texts)
+
+    def _get_many(self, texts: list[str]) -> list[np.ndarray | None]:
+        results = []
+        refreshed = False
+        for text in texts:
+            key = self.key(text)
+            vector = self.memory.get(key)
+            if vector is not None:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+            elif self.disk is not None:
+                if key not in self.disk.index and not refreshed:
+                    self.disk.refresh()  # 其他进程可能已写入
+                    refreshed = True
+                vector = self.disk.get(key)
+                if vector is not None:
+                    self.disk_hits += 1
+                    self._remember(key, vector)
+            if vector is None:
+                self.misses += 1
+            results.append(vector)
+        return results
+
+    def put_many(self, texts: list[str], vectors: np.ndarray):
+        # 跳过并发请求已经写入的文本，避免磁盘层重复追加
+        with self._lock:
+            new_keys, new_vectors = [], []
+            for text, vector in zip(texts, vectors):
+                key = self.key(text)
+                if key not in self.memory:
+                    new_keys.append(key)
+                    new_vectors.append(vector)
+                self._remember(key, vector)
+            if self.disk is not None and new_keys:
+                self.disk.put_many(new_keys, np.stack(new_vectors))
+
+    async def get_many_async(self, texts: list[str]) -> list[np.ndarray | None]:
+        """
+        在事件循环中查询缓存：磁盘层的刷新索引、memmap 读取会阻塞，放到线程池执行；
+        只有内存层时直接查询
+        """
+        if self.disk is None or not texts:
+            return self.get_many(texts)
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_many, texts)
+
+    async def put_many_async(self, texts: list[str], vectors: np.ndarray):
+        """在事件循环中回填缓存：磁盘层的加锁、追加写入和 flush 放到线程池执行"""
+        if self.disk is None:
+            self.put_many(texts, vectors)
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, self.put_many, texts, vectors)
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "disk_entries": len(self.disk) if self.disk is not None else 0,
+        }
+
+
+class CatalogTable:
+    """
+    只读的商品目录向量表：vectors.f32 为 float32 行矩阵（memmap 映射），index.txt 为“文本哈希 行号”，
+    meta.json 记录导出所用的模型名称（客户端请求的注册名 EMBED_SERVICE_MODEL）。目录名称类文本（分类、品牌、SPU、SKU、属性值）精确命中时 O(1) 返回索引中的向量。
+    """
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory).expanduser()
+        self.meta = json.loads((self.directory / "meta.json").read_text())
+        self.dim = self.meta["dim"]
+        self.index: dict[str, int] = {}
+        with open(self.directory / "index.txt") as f:
+            for line in f:
+                key, row = line.split()
+                self.index[key] = int(row)
+        self.vectors = np.memmap(
+            self.directory / "vectors.f32",
+            dtype="<f4",
+            mode="r",
+            shape=(self.meta["rows"], self.dim),
+        )
+        self.hits = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def matches(self, name: str, dim: int) -> bool:
+        """导出所用模型与当前模型的注册名称、维度一致时才可使用"""
+        return self.meta["model"] == name and self.dim == dim
+
+    def get_many(self, texts: list[str]) -> list[np.ndarray | None]:
+        results = []
+        for text in texts:
+            row = self.index.get(hashlib.sha1(text.encode()).hexdigest())
+            if row is not None:
+                self.hits += 1
+                results.append(np.array(self.vectors[row]))
+            else:
+                results.append(None)
+        return results
+
+
+def load_catalog(name: str, model) -> CatalogTable | None:
+    """按配置加载目录向量表，与当前模型（按注册名称）不匹配时不启用"""
+    if not CATALOG_DIR:
+        return None
+    catalog = CatalogTable(CATALOG_DIR)
+    if not catalog.matches(name, model.get_sentence_embedding_dimension()):
+        print(
+            f"[embed_service] Catalog table model {catalog.meta['model']!r} "
+            f"does not match {name!r}, skipped"
+        )
+        return None
+    print(f"[embed_service] Catalog table: {catalog.directory} ({len(catalog)} texts)")
+    return catalog
+
+
+def create_cache(model_id: str, model) -> EmbeddingCache:
+    """按配置创建向量缓存，磁盘层按模型ID分子目录存放"""
+    disk = None
+    if CACHE_DIR:
+        sub_dir = hashlib.sha1(model_id.encode()).hexdigest()[:16]
+        disk = DiskEmbeddingStore(
+            Path(CACHE_DIR) / sub_dir, model.get_sentence_embedding_dimension()
+        )
+        print(f"[embed_service] Disk cache: {disk.directory} ({len(disk)} entries)")
+    return EmbeddingCache(model_id, NORMALIZE_EMBEDDINGS, CACHE_MAX_ENTRIES, disk)
+
+
+class MicroBatcher:
+    """
+    请求合并器：收集等待窗口内的并发请求，合并后只调用一次 encode，再按请求拆分结果。
+    GraphRAG 每次只发送 1~4 个实体，合并后能摊薄每次前向计算的固定开销。
+        max_wait_ms: 第一个请求到达后最多等待多久再发车
+        max_batch_size: 单次合并的最大文本数，达到后立即发车
+    """
+
+    def __init__(self, encode_fn, max_wait_ms: float, max_batch_size: int):
+        self.encode_fn = encode_fn
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+        self.queued_texts = 0  # 排队中（尚未开始编码）的文本数
+        self.batches = 0
+        self.dropped = 0  # 调用方已超时/取消而被丢弃的请求数
+
+    def start(self):
+        """在当前事件循环中启动合并任务（首次提交时自动调用）"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, texts: list[str]) -> np.ndarray:
+        """提交一次请求的文本，等待合并批次完成后返回该请求对应的向量"""
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        if self._task is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.queued_texts += len(texts)
+        await self.queue.put((texts, future))
+        return await future
+
+    def stats(self) -> dict:
+        return {
+            "queued_requests": self.queue.qsize(),
+            "queued_texts": self.queued_texts,
+            "batches": self.batches,
+            "dropped": self.dropped,
+        }
+
+    async def _collect(self) -> list:
+        """阻塞等待第一个请求，然后在等待窗口内继续收集，直到超时或达到批次上限"""
+        items = [await self.queue.get()]
+        size = len(items[0][0])
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            try:
+                if timeout <= 0:  # 窗口已过，只取已排队的请求
+                    item = self.queue.get_nowait()
+                else:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+            items.append(item)
+            size += len(item[0])
+        return items
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._collect()
+            self.queued_texts -= sum(len(item_texts) for item_texts, _ in items)
+            # 调用方已超时或断开（future 被取消）的请求不再计算
+            live_items = [item for item in items if not item[1].done()]
+            self.dropped += len(items) - len(live_items)
+            items = live_items
+            if not items:
+                continue
+            self.batches += 1
+            # 合并所有请求的文本（并发请求中的重复文本只算一次），在线程池中执行一次 encode，避免阻塞事件循环
+            texts = [t for item_texts, _ in items for t in item_texts]
+            unique_texts = list(dict.fromkeys(texts))
+            try:
+                embeddings = await loop.run_in_executor(
+                    None, self.encode_fn, unique_texts
+                )
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            # 按请求顺序拆分结果
+            positions = {t: i for i, t in enumerate(unique_texts)}
+            for item_texts, future in items:
+                if not future.done():  # 调用方可能已取消
+                    future.set_result(embeddings[[positions[t] for t in item_texts]])
+
+
+class ModelEntry:
+    """一个常驻模型及其专属的向量缓存、请求合并器和延迟统计"""
+
+    def __init__(self, name: str, model_id: str, model, memory_bytes: int):
+        self.name = name
+        self.model_id = model_id
+        self.model = model
+        self.memory_bytes = memory_bytes
+        self.cache = create_cache(model_id, model)
+        self.catalog = load_catalog(name, model)
+        self.batcher = MicroBatcher(self.encode, BATCH_MAX_WAIT_MS, BATCH_MAX_SIZE)
+        self.load_s = 0.0
+        self.warmup_s = None  # 预热完成前为 None
+        self.inflight = 0
+        self.requests = 0
+        self.texts = 0
+        self.uncached_texts = 0  # 请求跳过目录表和缓存（cache=false）的文本数
+        self.latencies_ms = deque(maxlen=1000)  # 最近请求的延迟，用于计算分位数
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """同步编码一批文本，按 token 预算分批，返回归一化后的向量矩阵"""
+        return encode_by_token_budget(
+            self.model, texts, BATCH_MAX_TOKENS, normalize_embeddings=NORMALIZE_EMBEDDINGS
         )
-        return SentenceTransformer(FALLBACK_MODEL_ID)
 
+    def warmup(self):
+        """
+        用不同长度的合成批次预热：触发分词器、torch 内核和内存分配的首次初始化，
+        避免第一个真实请求承担冷启动开销。预热结果不写入缓存。
+        """
+        start = time.perf_counter()
+        long_texts = ["商品" * n for n in (32, 64, 128)]
+        self.encode(SAMPLE_TEXTS[:1])  # 单条请求
+        self.encode(SAMPLE_TEXTS + long_texts)  # 混合长度批次
+        self.encode(SAMPLE_TEXTS * max(1, BATCH_MAX_SIZE // len(SAMPLE_TEXTS)))  # 满批次
+        self.warmup_s = time.perf_counter() - start
 
-# 加载模型（启动时执行）
-model = load_model()
+    async def embed(self, texts: list[str], use_cache: bool = True) -> np.ndarray:
+        """
+        依次查目录向量表、缓存，只把都未命中的文本（去重后）交给合并器编码，再回填缓存。
+        目录表命中的向量与写入 Neo4j 的向量完全一致，不写入缓存。
+        use_cache=False 时跳过目录表和缓存（也不回填），所有文本都由模型实际编码。
+        """
+        start = time.perf_counter()
+        self.inflight += 1
+        try:
+            if self.catalog is not None and use_cache:
+                vectors = self.catalog.get_many(texts)
+            else:
+                vectors = [None] * len(texts)
+            if use_cache:
+                pending = [i for i, v in enumerate(vectors) if v is None]
+                cached = await self.cache.get_many_async([texts[i] for i in pending])
+                for i, v in zip(pending, cached):
+                    vectors[i] = v
+            else:
+                self.uncached_texts += len(texts)
+            missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+            if missing:
+                computed = await self.batcher.submit(missing)
+                if use_cache:
+                    await self.cache.put_many_async(missing, computed)
+                computed_map = dict(zip(missing, computed))
+                vectors = [
+                    v if v is not None else computed_map[t] for t, v in zip(texts, vectors)
+                ]
+        finally:
+            self.inflight -= 1
+        self.requests += 1
+        self.texts += len(texts)
+        self.latencies_ms.append((time.perf_counter() - start) * 1000)
+        if not vectors:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack(vectors)
+
+    def stats(self) -> dict:
+        latency = None
+        if self.latencies_ms:
+            p50, p99 = np.percentile(self.latencies_ms, [50, 99])
+            latency = {"p50": float(p50), "p99": float(p99), "max": max(self.latencies_ms)}
+        return {
+            "model_id": self.model_id,
+            "memory_mb": self.memory_bytes / 2**20,
+            "load_s": self.load_s,
+            "warmup_s": self.warmup_s,
+            "requests": self.requests,
+            "texts": self.texts,
+            "inflight": self.inflight,
+            "latency_ms": latency,
+            "catalog_hits": self.catalog.hits if self.catalog is not None else None,
+            "uncached_texts": self.uncached_texts,
+            "cache": self.cache.stats(),
+            "batcher": self.batcher.stats(),
+        }
+
+
+def parse_model_specs(spec: str) -> dict[str, str]:
+    """解析 EMBED_MODELS，返回 名称 -> 模型路径/HuggingFace 名称，默认模型总是第一个"""
+    specs = {DEFAULT_MODEL_NAME: PRIMARY_MODEL_ID}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, _, path = item.partition("=")
+        specs[name.strip()] = path.strip() or name.strip()
+    return specs
+
+
+class ModelRegistry:
+    """
+    多模型注册表：按请求中的模型名称在首次使用时加载并预热，最多常驻 max_models 个模型，
+    超过数量或内存预算时卸载最久未使用的模型。默认模型服务 Rasa 的主检索链路，常驻不卸载。
+    未登记的名称回退到默认模型，兼容此前忽略 model 字段的客户端。
+    """
+
+    def __init__(
+        self,
+        specs: dict[str, str],
+        default_name: str,
+        max_models: int,
+        memory_budget_mb: float,
+    ):
+        self.specs = specs
+        self.default_name = default_name
+        self.max_models = max(1, max_models)
+        self.memory_budget = memory_budget_mb * 2**20
+        self.entries: OrderedDict[str, ModelEntry] = OrderedDict()  # 按最近使用排序
+        self.unloaded = 0
+        self._load_lock = threading.Lock()
+        self._loading: dict[str, asyncio.Future] = {}  # 正在线程池中加载的模型
+        self._unknown_names = set()
+
+    def resolve(self, name: str) -> str:
+        if name in self.specs:
+            return name
+        if name not in self._unknown_names:
+            self._unknown_names.add(name)
+            print(f"[embed_service] Unknown model {name!r}, using {self.default_name!r}")
+        return self.default_name
+
+    def load(self, name: str) -> ModelEntry:
+        """同步加载模型并登记为常驻（已常驻则直接返回），供启动流程在事件循环之外调用"""
+        with self._load_lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                entry = self._build(name)
+                self.entries[name] = entry
+            return entry
+
+    def _build(self, name: str) -> ModelEntry:
+        fallback = FALLBACK_MODEL_ID if name == self.default_name else None
+        rss_before = rss_bytes()
+        start = time.perf_counter()
+        model_id, model = load_model(self.specs[name], fallback)
+        entry = ModelEntry(name, model_id, model, model_memory_bytes(model, rss_before))
+        entry.load_s = time.perf_counter() - start
+        return entry
+
+    def default(self) -> ModelEntry | None:
+        return self.entries.get(self.default_name)
+
+    async def get(self, name: str) -> ModelEntry:
+        """取得请求对应的模型，未加载时在线程池中加载并预热，再按 LRU 卸载超出限制的模型"""
+        name = self.resolve(name)
+        entry = self.entries.get(name)
+        if entry is None or entry.warmup_s is None:
+            # 同一模型的并发请求共用一次加载；shield 避免某个请求被取消时中断其他请求的等待
+            future = self._loading.get(name)
+            if future is None:
+                future = asyncio.get_running_loop().run_in_executor(
+                    None, self._load_and_warmup, name
+                )
+                future.add_done_callback(functools.partial(self._loaded, name))
+                self._loading[name] = future
+            entry = await asyncio.shield(future)
+            await self._evict(keep=name)
+        self.entries.move_to_end(name)
+        return entry
+
+    def _load_and_warmup(self, name: str) -> ModelEntry:
+        """在线程池中加载并预热，不修改 entries：登记由 _loaded 在事件循环线程中完成"""
+        with self._load_lock:
+            entry = self.entries.get(name) or self._build(name)
+        if entry.warmup_s is None:
+            entry.warmup()
+        return entry
+
+    def _loaded(self, name: str, future: asyncio.Future):
+        self._loading.pop(name, None)
+        if not future.cancelled() and future.exception() is None:
+            self.entries.setdefault(name, future.result())
+
+    def memory_bytes(self) -> int:
+        return sum(e.memory_bytes for e in list(self.entries.values()))
+
+    async def _evict(self, keep: str):
+        while len(self.entries) > self.max_models or (
+            self.memory_budget and self.memory_bytes() > self.memory_budget
+        ):
+            # 从最久未使用的开始，跳过默认模型、刚请求的模型和仍有在途请求的模型
+            victim = next(
+                (
+                    n
+                    for n, e in list(self.entries.items())
+                    if n not in (self.default_name, keep) and e.inflight == 0
+                ),
+                None,
+            )
+            if victim is None:
+                break
+            entry = self.entries.pop(victim)
+            await entry.batcher.stop()
+            print(
+                f"[embed_service] Unloaded model {victim!r} "
+                f"({entry.memory_bytes / 2**20:.0f} MB)"
+            )
+            del entry
+            gc.collect()
+            self.unloaded += 1
+
+    def stats(self) -> dict:
+        return {
+            "default": self.default_name,
+            "registered": list(self.specs),
+            "resident": list(self.entries),
+            "memory_mb": self.memory_bytes() / 2**20,
+            "unloaded": self.unloaded,
+            # 单进程启动时默认模型由后台线程登记，先取快照再遍历
+            "entries": {name: e.stats() for name, e in list(self.entries.items())},
+        }
+
+    async def close(self):
+        for entry in list(self.entries.values()):
+            await entry.batcher.stop()
+
+
+registry = ModelRegistry(
+    parse_model_specs(EXTRA_MODELS),
+    DEFAULT_MODEL_NAME,
+    MAX_RESIDENT_MODELS,
+    MODEL_MEMORY_BUDGET_MB,
+)
+
+
+class AdmissionController:
+    """
+    有界准入：在途请求数或在途文本数超过上限时立即拒绝（429 + Retry-After），
+    避免突发流量在线程池/队列中无限堆积，拖慢所有请求。所有调用都在事件循环线程中，无需加锁。
+    """
+
+    def __init__(self, max_requests: int, max_texts: int, retry_after: int):
+        self.max_requests = max_requests
+        self.max_texts = max_texts
+        self.retry_after = retry_after
+        self.inflight_requests = 0
+        self.inflight_texts = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def acquire(self, n_texts: int):
+        # 空闲时单个超大请求也放行，否则它永远无法被接收
+        if self.inflight_requests >= self.max_requests or (
+            self.inflight_texts and self.inflight_texts + n_texts > self.max_texts
+        ):
+            self.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail="embedding service is overloaded",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        self.inflight_requests += 1
+        self.inflight_texts += n_texts
+        self.admitted += 1
+
+    def release(self, n_texts: int):
+        self.inflight_requests -= 1
+        self.inflight_texts -= n_texts
+
+    def stats(self) -> dict:
+        return {
+            "inflight_requests": self.inflight_requests,
+            "inflight_texts": self.inflight_texts,
+            "max_inflight_requests": self.max_requests,
+            "max_inflight_texts": self.max_texts,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+admission = AdmissionController(MAX_INFLIGHT_REQUESTS, MAX_INFLIGHT_TEXTS, RETRY_AFTER_S)
+
+
+def request_timeout(timeout_ms: float | None) -> float | None:
+    """请求超时（秒）：优先使用请求头 X-Request-Timeout-Ms，其次为服务默认值"""
+    timeout_ms = timeout_ms or REQUEST_TIMEOUT_MS
+    return timeout_ms / 1000 if timeout_ms > 0 else None
+
+
+def initialize():
+    """加载并预热默认模型，完成后标记就绪并打印启动耗时分解"""
+    try:
+        entry = registry.load(registry.default_name)
+        entry.warmup()
+        startup["timings"]["load_model_s"] = entry.load_s
+        startup["timings"]["warmup_s"] = entry.warmup_s
+    except Exception as e:
+        startup["error"] = repr(e)
+        print(f"[embed_service] Startup failed: {e!r}")
+        raise
+    startup["timings"]["total_s"] = time.perf_counter() - _process_start
+    startup["ready"] = True
+    breakdown = ", ".join(f"{k}={v:.2f}" for k, v in startup["timings"].items())
+    print(f"[embed_service] Ready ({breakdown})")
+
+
+def ensure_ready():
+    if not startup["ready"]:
+        raise HTTPException(
+            status_code=503,
+            detail=startup["error"] or "model is loading",
+            headers={"Retry-After": "1"},
+        )
+
+
+async def embed_texts(model_name: str, texts: list[str], use_cache: bool = True) -> np.ndarray:
+    """按名称取得模型（必要时加载）并编码文本"""
+    entry = await registry.get(model_name)
+    return await entry.embed(texts, use_cache)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if registry.default() is not None:
+        # 多 worker 模式：模型已由主进程（ONNX 后端为 worker 自身）加载，预热完成后才开始接收连接，不让请求落到冷 worker 上
+        await asyncio.get_running_loop().run_in_executor(None, initialize)
+    else:
+        # 单进程：后台加载，端口立即可用，就绪状态通过 /readyz 查询
+        threading.Thread(target=initialize, name="embed-init", daemon=True).start()
+    yield
+    await registry.close()
 
 
 # 请求格式
 class EmbeddingRequest(BaseModel):
     model: str
     input: str | list[str]
+    # 兼容 OpenAI：base64 为小端序原始字节，客户端可用 numpy.frombuffer 直接解码
+    encoding_format: Literal["float", "base64"] = "float"
+    # 扩展字段：base64 编码时的元素类型，float16 体积再减半
+    dtype: Literal["float32", "float16"] = "float32"
+    # 扩展字段：False 时跳过目录向量表和缓存，由模型实际编码（索引构建使用，模型或后端变化后写入的才是新向量）
+    cache: bool = True
+
+
+# 序列化耗时统计
+serialize_stats = {"requests": 0, "total_ms": 0.0, "total_bytes": 0}
+
+
+def format_embeddings(
+    embeddings: np.ndarray, encoding_format: str, dtype: str
+) -> list[list[float]] | list[str]:
+    """按请求的编码格式转换向量：float 为浮点数列表，base64 为逐行编码的原始字节"""
+    if encoding_format == "float":
+        return embeddings.tolist()
+    raw = np.ascontiguousarray(embeddings, dtype="<f2" if dtype == "float16" else "<f4")
+    return [base64.b64encode(row.tobytes()).decode("ascii") for row in raw]
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 
 @app.post("/embeddings")
-def embed(request: EmbeddingRequest):
-    embed_batch_size = 64  # 每次处理64个句子
+async def embed(
+    request: EmbeddingRequest,
+    x_request_timeout_ms: float | None = Header(default=None),
+):
+    ensure_ready()
     # 统一转成list
     texts = [request.input] if isinstance(request.input, str) else request.input
-    # 使用模型对文本进行编码，批量大小为64，同时进行向量归一化
-    embeddings = model.encode(
-        texts, batch_size=embed_batch_size, normalize_embeddings=True
+    admission.acquire(len(texts))
+    try:
+        # 缓存未命中的文本交给合并器与其他并发请求一起编码（向量已归一化）
+        # 超过截止时间后放弃等待，排队中的文本随之被合并器丢弃
+        embeddings = await asyncio.wait_for(
+            embed_texts(request.model, texts, request.cache), request_timeout(x_request_timeout_ms)
+        )
+    except asyncio.TimeoutError:
+        admission.timed_out += 1
+        raise HTTPException(status_code=504, detail="embedding deadline exceeded")
+    finally:
+        admission.release(len(texts))
+
+    # 按照OpenAI Embedding API的格式返回结果，直接渲染 JSONResponse 以跳过 FastAPI 的逐元素校验
+    start = time.perf_counter()
+    embeddings = format_embeddings(embeddings, request.encoding_format, request.dtype)
+    response = JSONResponse(
+        {
+            "object": "list",
+            "model": request.model,
+            "data": [
+                {
+                    "object": "embedding",
+                    "embedding": embed,
+                    "index": i,
+                }
+                for i, embed in enumerate(embeddings)
+            ],
+        }
+    )
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    serialize_stats["requests"] += 1
+    serialize_stats["total_ms"] += elapsed_ms
+    serialize_stats["total_bytes"] += len(response.body)
+    response.headers["X-Serialize-Ms"] = f"{elapsed_ms:.3f}"
+    return response
+
+
+async def read_ndjson(request: Request):
+    """逐块读取请求体，按行解析 NDJSON 记录，不把整个请求体读入内存"""
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if buffer.strip():
+        yield json.loads(buffer)
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    边读请求体边返回响应的流式响应。
+    StreamingResponse 在发送期间会监听断开事件并消费请求消息，导致后续读不到请求体，这里只发送响应。
+    on_close 在响应结束（包括客户端中途断开）时调用。
+    """
+
+    def __init__(self, content, on_close=None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        finally:
+            if self.on_close is not None:
+                self.on_close()
+
+
+@app.post("/embeddings/stream")
+async def embed_stream(
+    request: Request,
+    model: str = DEFAULT_MODEL_NAME,
+    encoding_format: Literal["float", "base64"] = "float",
+    dtype: Literal["float32", "float16"] = "float32",
+):
+    """
+    批量嵌入流式接口：请求体为分块传输的 NDJSON，每行 {"id": ..., "text": ...}；
+    每攒够 STREAM_BATCH_SIZE 条编码一次，立即以 NDJSON 返回 {"id": ..., "embedding": ...}。
+    内存占用只与批大小有关，客户端可以边接收边写库。
+    准入时按一个请求、STREAM_BATCH_SIZE 条文本计数，直到流结束才释放。
+    """
+    ensure_ready()
+    admission.acquire(STREAM_BATCH_SIZE)
+
+    async def encode_batch(records):
+        embeddings = await embed_texts(model, [r["text"] for r in records])
+        embeddings = format_embeddings(embeddings, encoding_format, dtype)
+        return "".join(
+            json.dumps({"id": r["id"], "embedding": e}, ensure_ascii=False) + "\n"
+            for r, e in zip(records, embeddings)
+        )
+
+    async def generate():
+        batch = []
+        try:
+            async for record in read_ndjson(request):
+                batch.append(record)
+                if len(batch) >= STREAM_BATCH_SIZE:
+                    yield await encode_batch(batch)
+                    batch = []
+            if batch:
+                yield await encode_batch(batch)
+        except (ValueError, KeyError) as e:
+            # 响应已开始发送，无法再改状态码，以错误记录结束流
+            yield json.dumps({"error": f"invalid record: {e!r}"}) + "\n"
+
+    return DuplexStreamingResponse(
+        generate(),
+        on_close=lambda: admission.release(STREAM_BATCH_SIZE),
+        media_type="application/x-ndjson",
     )
-    embeddings = embeddings.tolist()
 
-    # 按照OpenAI Embedding API的格式返回结果
+
+@app.get("/healthz")
+def healthz():
+    """存活探针：进程可以响应即返回 200"""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz():
+    """就绪探针：模型加载并预热完成后返回 200，否则返回 503"""
+    entry = registry.default()
+    body = {
+        "ready": startup["ready"],
+        "model": entry.model_id if entry is not None else None,
+        "error": startup["error"],
+        "timings": startup["timings"],
+    }
+    return JSONResponse(body, status_code=200 if startup["ready"] else 503)
+
+
+@app.get("/stats")
+def stats():
+    """服务运行指标：各模型的延迟/内存/缓存命中/合并队列，准入计数、序列化耗时等"""
     return {
-        "object": "list",
-        "data": [
-            {
-                "object": "embedding",
-                "embedding": embed,
-                "index": i,
-            }
-            for i, embed in enumerate(embeddings)
-        ],
+        "pid": os.getpid(),
+        "ready": startup["ready"],
+        "models": registry.stats(),
+        "admission": admission.stats(),
+        "serialize": serialize_stats,
     }
 
 
-if __name__ == "__main__":
+def share_model_memory():
+    """把 torch 权重移到共享内存，fork 出的 worker 复用同一份权重而不是各自复制"""
+    try:
+        import torch
+    except ImportError:
+        return
+    for entry in registry.entries.values():
+        if isinstance(entry.model, torch.nn.Module):
+            entry.model.share_memory()
+
+
+def run_worker(sock, threads: int):
+    """
+    worker 子进程：固定 torch / onnxruntime 线程数后在继承的监听 socket 上运行 uvicorn。
+    ONNX 后端的推理会话（及其线程池）不能跨 fork 使用，由每个 worker 在 fork 后自行加载。
+    """
+    global onnx_threads
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=10010)
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    if BACKEND != "torch":
+        onnx_threads = threads
+        registry.load(registry.default_name)
+    uvicorn.Server(uvicorn.Config(app)).run(sockets=[sock])
+    os._exit(0)
+
+
+def serve(host: str, port: int, workers: int):
+    """
+    启动服务。workers > 1 时为预派生模式：主进程加载一次模型并绑定端口，再 fork 出 N 个 worker，
+    权重通过写时复制/共享内存共享，连接由内核在共享的监听 socket 上分发给各个 worker。
+    ONNX 后端的推理会话不能跨 fork 共享，主进程不加载模型，由各 worker 在 fork 后加载各自的会话。
+    注意：主进程在 fork 前不应执行推理（如首次导出 ONNX 时的一致性校验），否则子进程可能因 OpenMP 状态卡死；
+    多 worker 启动 ONNX 后端前需先单进程启动一次完成导出。
+    """
+    import signal
+    import socket
+    import uvicorn
+
+    if workers <= 1:
+        uvicorn.run(app, host=host, port=port)
+        return
+
+    if BACKEND == "torch":
+        registry.load(registry.default_name)
+        share_model_memory()
+    else:
+        quantize = BACKEND == "onnx-int8"
+        candidates = (registry.specs[registry.default_name], FALLBACK_MODEL_ID)
+        if not any((onnx_export_dir(m) / onnx_file_name(quantize)).exists() for m in candidates):
+            raise SystemExit(
+                f"[embed_service] ONNX model not exported yet (backend={BACKEND}), "
+                "start once with --workers 1 to export it"
+            )
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    threads = WORKER_THREADS or max(1, (os.cpu_count() or 1) // workers)
+    print(
+        f"[embed_service] Listening on {host}:{port} with {workers} workers "
+        f"({threads} {'torch' if BACKEND == 'torch' else 'onnxruntime'} threads each)"
+    )
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                run_worker(sock, threads)
+            finally:
+                os._exit(1)  # 加载或启动失败时不回到主进程的代码
+        children.add(pid)
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    for _ in range(workers):
+        spawn()
+    # 等待子进程退出，非主动关停时自动拉起新的 worker
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            print(f"[embed_service] Worker {pid} exited ({status}), respawning")
+            spawn()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="BGE 嵌入模型服务")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=10010)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="worker 进程数")
+    parser.add_argument(
+        "--check-parity",
+        action="store_true",
+        help="比较当前后端与 torch 模型在样例文本上的输出后退出",
+    )
+    args = parser.parse_args()
+
+    if args.check_parity:
+        entry = registry.load(registry.default_name)
+        reference_id = entry.model_id.split("#")[0]
+        print(json.dumps(check_parity(entry.model, reference_id), ensure_ascii=False))
+    else:
+        serve(args.host, args.port, args.workers)
@@ -0,0 +1,123 @@
+"""
+入口节点的异步混合检索：在 Neo4j 异步会话中执行向量 + 全文检索，不占用事件循环。
+一次路由的所有（标签, 实体）由一条 UNWIND 语句检索，每个实体的向量索引和全文索引查询都在同一次往返中完成。
+启用进程内向量镜像（vector_mirror.py）时，向量检索结果由调用方传入，语句中只按 elementId 取节点。
+融合方式与 neo4j_graphrag 的 HybridRetriever 一致：两路结果各自除以本路最高分归一化，
+同一节点取较高得分，按得分降序取 top_k；返回的节点属性中不含嵌入向量和全文索引属性。
+"""
+
+from neo4j import READ_ACCESS, Query
+
+# 节点返回时去掉的索引属性（由 create_indexing.py 写入）
+index_properties = ("embedding", "embedding_hash", "fulltext", "fulltext_hash")
+_node_projection = "node {.*, " + ", ".join(f"`{p}`: null" for p in index_properties) + "}"
+
+# $requests: [{i, vector_index_name, fulltext_index_name, query_text, query_vector, vector_hits}]，每行返回该实体的融合结果
+# vector_hits 不为空时（向量镜像的检索结果 [{id, score}]）不再查询向量索引；全文检索文本为空（分词后没有有效词）时只做向量检索
+hybrid_query = (
+    "UNWIND $requests AS req "
+    "CALL { "
+    "WITH req "
+    "CALL { "
+    "WITH req "
+    "WITH req WHERE req.vector_hits IS NULL "
+    "CALL db.index.vector.queryNodes(req.vector_index_name, $candidates, req.query_vector) "
+    "YIELD node, score "
+    "WITH collect({node: node, score: score}) AS nodes, max(score) AS max_score "
+    "UNWIND nodes AS n "
+    "RETURN n.node AS node, n.score / max_score AS score "
+    "UNION "
+    "WITH req "
+    "UNWIND req.vector_hits AS hit "
+    "MATCH (node) WHERE elementId(node) = hit.id "
+    "WITH collect({node: node, score: hit.score}) AS nodes, max(hit.score) AS max_score "
+    "UNWIND nodes AS n "
+    "RETURN n.node AS node, n.score / max_score AS score "
+    "UNION "
+    "WITH req "
+    "WITH req WHERE req.query_text <> '' "
+    "CALL db.index.fulltext.queryNodes(req.fulltext_index_name, req.query_text, {limit: $candidates}) "
+    "YIELD node, score "
+    "WITH collect({node: node, score: score}) AS nodes, max(score) AS max_score "
+    "UNWIND nodes AS n "
+    "RETURN n.node AS node, n.score / max_score AS score "
+    "} "
+    "WITH node, max(score) AS score ORDER BY score DESC LIMIT $top_k "
+    f"RETURN collect({{node: {_node_projection}, score: score}}) AS results "
+    "} "
+    "RETURN req.i AS i, results"
+)
+fulltext_query = (
+    "UNWIND $requests AS req "
+    "CALL { "
+    "WITH req "
+    "WITH req WHERE req.query_text <> '' "
+    "CALL db.index.fulltext.queryNodes(req.fulltext_index_name, req.query_text, {limit: $top_k}) "
+    "YIELD node, score "
+    f"RETURN collect({{node: {_node_projection}, score: score}}) AS results "
+    "} "
+    "RETURN req.i AS i, results"
+)
+
+
+async def run_read(driver, query, params=None, timeout=None):
+    """在异步只读会话中执行查询，返回记录列表；timeout（秒）由服务端终止超时的事务"""
+    async with driver.session(default_access_mode=READ_ACCESS) as session:
+        result = await session.run(Query(query, timeout=timeout), params)
+        return [record async for record in result]
+
+
+def _requests(items, vector_hits=None):
+    items = list(items)
+    vector_hits = vector_hits or [None] * len(items)
+    return [
+        {
+            "i": i,
+            "vector_index_name": label.lower() + "_vector",
+            "fulltext_index_name": label.lower() + "_fulltext",
+            "query_text": query_text,
+            # 已有镜像检索结果时不再传查询向量
+            "query_vector": query_vector if hits is None else None,
+            "vector_hits": hits,
+        }
+        for i, ((label, query_text, query_vector), hits) in enumerate(zip(items, vector_hits))
+    ]
+
+
+async def _batch(driver, query, requests, params, timeout):
+    """执行批量检索语句，按请求顺序返回每个实体的结果列表"""
+    if not requests:
+        return []
+    records = await run_read(driver, query, {"requests": requests, **params}, timeout)
+    results = [[] for _ in requests]
+    for record in records:
+        results[record["i"]] = record["results"]
+    return results
+
+
+async def hybrid_search(driver, items, top_k, effective_search_ratio=2, timeout=None, vector_hits=None):
+    """
+    批量混合检索，一次往返
+        items: [(标签, 全文检索文本, 查询向量)]，索引名称为 {label}_vector / {label}_fulltext（小写）
+        effective_search_ratio: 每路先取 top_k * effective_search_ratio 个候选再融合
+        vector_hits: 可选，与 items 对应的向量镜像检索结果，某项为 None 时该实体仍查询向量索引
+    返回与 items 顺序一致的列表，每项为按得分降序的 [{"node": 节点属性, "score": 得分}]
+    """
+    return await _batch(
+        driver,
+        hybrid_query,
+        _requests(items, vector_hits),
+        {"candidates": top_k * effective_search_ratio, "top_k": top_k},
+        timeout,
+    )
+
+
+async def fulltext_search(driver, items, top_k, timeout=None):
+    """批量全文检索（实体向量化失败时使用），items: [(标签, 全文检索文本)]，返回格式同 hybrid_search"""
+    return await _batch(
+        driver,
+        fulltext_query,
+        _requests((label, query_text, None) for label, query_text in items),
+        {"top_k": top_k},
+        timeout,
+    )
@@ -19,24 +19,33 @@
 """
 
 import os
-import re
 import json
 import dotenv
-import jieba
 import logging
 import asyncio
 from typing import Any, Text
-from neo4j import GraphDatabase
+from neo4j import AsyncGraphDatabase
 from pydantic import BaseModel, Field
 from langchain_core.documents import Document
-from neo4j.exceptions import CypherSyntaxError
+from neo4j.exceptions import ClientError
 from rasa.utils.endpoints import EndpointConfig
-from neo4j_graphrag.retrievers import HybridRetriever
 from langchain_community.chat_models.tongyi import ChatTongyi
 from langchain_community.graphs.neo4j_graph import Neo4jGraph
 from neo4j_graphrag.retrievers.text2cypher import extract_cypher
 from rasa.core.information_retrieval import SearchResultList, InformationRetrieval
 from langchain_community.chains.graph_qa.cypher import CypherQueryCorrector, Schema
+try:
+    from addons.tokenization import tokenize, get_tokenizer
+    from addons.semantic_cache import SemanticCache, normalize_query
+    from addons.cypher_templates import TemplateMatcher, entity_matches
+    from addons.hybrid_retrieval import run_read, hybrid_search, fulltext_search
+    from addons.vector_mirror import VectorMirror
+except ImportError:  # 在 addons 目录下直接运行本文件测试时
+    from tokenization import tokenize, get_tokenizer
+    from semantic_cache import SemanticCache, normalize_query
+    from cypher_templates import TemplateMatcher, entity_matches
+    from hybrid_retrieval import run_read, hybrid_search, fulltext_search
+    from vector_mirror import VectorMirror
 from langchain_core.prompts import (
     ChatPromptTemplate,
     SystemMessagePromptTemplate,
@@ -79,6 +88,21 @@ def get_chat_history(tracker_state: dict[str, Any], user_id) -> dict[str]:
     return "\n".join(chat_history[-5:])
 
 
+def is_follow_up(tracker_state: dict[str, Any]) -> bool:
+    """路由使用的最近 5 条聊天记录中是否有之前的用户提问；有则当前问题的含义可能依赖上下文（如“那白色的呢”）"""
+    turns = [
+        event.get("event")
+        for event in tracker_state.get("events") or []
+        if event.get("event") in ("user", "bot")
+    ]
+    return turns[-5:].count("user") > 1
+
+
+def routing_context(route_res) -> str:
+    """路由结果（标签和实体）的规范化表示，作为追问的缓存键"""
+    return "|".join(sorted(f"{i.label}={normalize_query(i.entity)}" for i in route_res if i.entity))
+
+
 class GraphRAG(InformationRetrieval):
     """继承了 Rasa 的 InformationRetrieval"""
 
@@ -170,8 +194,10 @@ class GraphRAG(InformationRetrieval):
         # 获取 endpoints.yml 下 vector_store 中的配置信息(rasa的api)
         neo4j_url = config.kwargs["neo4j_url"]
         neo4j_auth = tuple(config.kwargs["neo4j_auth"])  # 元组(用户名，密码)
-        # Neo4j 驱动
-        self.driver = GraphDatabase.driver(neo4j_url, auth=neo4j_auth)
+        # Neo4j 异步驱动：查询在事件循环中等待，慢查询不阻塞其他会话；连接池参数见 endpoints.yml 中 vector_store.neo4j_pool
+        pool_config = dict(config.kwargs.get("neo4j_pool", {}))
+        self.query_timeout = pool_config.pop("query_timeout", None)
+        self.driver = AsyncGraphDatabase.driver(neo4j_url, auth=neo4j_auth, **pool_config)
 
         # 2、获取图数据库schema
         # Neo4j Graph 包装器
@@ -191,6 +217,8 @@ class GraphRAG(InformationRetrieval):
 
         # 3、初始化 Cypher查询校正器（langchain提供的api）
         self.cypher_corrector = CypherQueryCorrector(corrector_schema)
+        # Cypher 模板：关系类型和方向从 schema 中查找
+        self.templates = TemplateMatcher(neo4j_graph.structured_schema.get("relationships"))
 
         # 4、配置 LLM（使用coder模型，对语法处理效果更好）
         # model_name = "qwen3-coder-plus-2025-07-22"
@@ -202,6 +230,16 @@ class GraphRAG(InformationRetrieval):
         # ChatTongyi：使用消息对象列表，支持SystemMessage、HumanMessage、AIMessage等
         self.llm = ChatTongyi(model=model_name, api_key=model_api_key)
 
+        # 5、预先加载分词器（领域词典的编译缓存），避免首次检索时才构建前缀词典
+        get_tokenizer()
+
+        # 6、检索结果缓存：热门问题命中后跳过整条 LLM 链路，参数见 endpoints.yml 中 vector_store.semantic_cache
+        self.cache = SemanticCache(**config.kwargs.get("semantic_cache", {}))
+
+        # 7、可选的进程内向量镜像：入口节点的向量检索不再请求 Neo4j 向量索引，参数见 vector_store.vector_mirror
+        mirror_config = dict(config.kwargs.get("vector_mirror", {}))
+        self.mirror = VectorMirror(**mirror_config) if mirror_config.pop("enabled", False) else None
+
     async def route_label(self, query):
         """
         路由标签识别：识别标签，抽取实体
@@ -225,12 +263,13 @@ class GraphRAG(InformationRetrieval):
         logger.info("入口节点标签与实体:%s", outputs)
         return outputs
 
-    async def node_retrieval(self, route_res, top_k):
+    async def node_retrieval(self, route_res, top_k, top_matches=None):
         """
         节点检索：根据标签和实体，检索入口节点
         对于用户节点直接通过Cypher查询获取，对于其他类型的节点则使用混合检索（向量+全文）进行检索
             route_res: 路由结果，包含标签和实体信息
             top_k: 检索返回的节点数量上限
+            top_matches: 可选，填充 {(标签, 实体): 与实体文本匹配的得分最高的节点名称}，供 Cypher 模板使用
         """
         pairs = []  # 用于存储需要检索的标签-实体对
         retrieved_nodes = {}  # 用于存储检索到的节点结果，以标签为键
@@ -239,9 +278,11 @@ class GraphRAG(InformationRetrieval):
             if not i.entity:  # 遍历路由结果中的每一项，如果实体为空则跳过当前项
                 continue
             if i.label == "User":  # 如果标签是"User"，则直接使用Cypher查询在数据库中查找用户节点。
-                user_node = self.driver.execute_query(
+                user_node = await run_read(
+                    self.driver,
                     "match (u:User) where u.user_id = $user_id return u;",
                     {"user_id": int(i.entity)},
+                    self.query_timeout,
                 )
                 retrieved_nodes.setdefault(i.label, []).append(user_node)  # 将结果添加到retrieved_nodes字典中
             else:  # 如果不是用户节点，则将标签和实体作为一个元组添加到pairs列表中，供后续检索使用
@@ -254,45 +295,47 @@ class GraphRAG(InformationRetrieval):
         labels, entities = zip(*pairs)
         labels, entities = list(labels), list(entities)
 
-        # 对每个实体进行中文分词处理，只保留中英文和数字字符，用" OR "连接，生成全文检索查询文本
-        query_texts = [
-            " OR ".join(
-                [
-                    word.strip()
-                    for word in jieba.lcut(entity)
-                    if re.fullmatch(r"[a-zA-Z0-9\u4e00-\u9fa5]+", word.strip())
-                ]
-            )
-            for entity in entities
-        ]
+        # 对每个实体进行中文分词处理（与建索引使用同一领域词典，品牌等名称保持整词），
+        # 只保留中英文和数字字符，用" OR "连接，生成全文检索查询文本
+        query_texts = [" OR ".join(tokenize(entity)) for entity in entities]
         # 对实体进行向量化处理，生成向量表示，用于向量检索
-        query_vectors = self.embeddings.embed_documents(entities)
-
-        # 为每个标签创建混合检索任务：
-        # ，指定驱动程序和索引名称（和）
-        tasks = []
-        for label, query_text, query_vector in zip(labels, query_texts, query_vectors):
-            # 创建HybridRetriever实例（neo4j_graphrag库）
-            retriever = HybridRetriever(
-                self.driver,
-                vector_index_name=label.lower() + "_vector",  # 向量索引名称
-                fulltext_index_name=label.lower() + "_fulltext",  # 全文索引名称
+        # 嵌入服务过载（429）或超时时降级为仅全文检索，不中断整个检索链路
+        try:
+            query_vectors = await asyncio.to_thread(self.embeddings.embed_documents, entities)
+        except Exception as e:
+            logger.warning("实体向量化失败，降级为全文检索: %s", e)
+            query_vectors = None
+
+        # 所有标签-实体对在一条 UNWIND 语句中检索（每对的向量索引 {label}_vector + 全文索引 {label}_fulltext），只需一次往返
+        if query_vectors is None:
+            results = await fulltext_search(
+                self.driver, list(zip(labels, query_texts)), top_k, self.query_timeout
             )
-            tasks.append(
-                # 将同步的检索操作包装为异步任务，以支持并发执行
-                asyncio.to_thread(
-                    retriever.get_search_results,
-                    query_text,
-                    query_vector,
-                    top_k,
-                    effective_search_ratio=2,
+        else:
+            effective_search_ratio = 2
+            # 向量镜像中有的标签在进程内检索，Neo4j 只按 elementId 取节点并与全文检索结果融合
+            vector_hits = None
+            if self.mirror is not None:
+                vector_hits = await asyncio.to_thread(
+                    self.mirror.search_many, labels, query_vectors, top_k * effective_search_ratio
                 )
+            results = await hybrid_search(
+                self.driver,
+                list(zip(labels, query_texts, query_vectors)),
+                top_k,
+                effective_search_ratio=effective_search_ratio,
+                timeout=self.query_timeout,
+                vector_hits=vector_hits,
             )
-        # 并发执行所有检索任务，并等待所有结果返回。
-        results = await asyncio.gather(*tasks)
 
         # 处理检索结果
-        for (label, _), result in zip(pairs, results): #遍历每一对标签和对应的检索结果
+        for (label, entity), records in zip(pairs, results): #遍历每一对标签和对应的检索结果
+            if top_matches is not None:
+                # 只采用与实体文本匹配的节点：融合得分按最高分归一化，第一名不一定是同一个实体
+                key = f"{label.lower()}_name" if label != "Attr" else f"{label.lower()}_value"
+                matched = [i for i in records if entity_matches(entity, i["node"][key])]
+                if matched:
+                    top_matches[(label, entity)] = max(matched, key=lambda i: i["score"])["node"][key]
             # 根据标签类型构建结果格式，提取节点名称/值和得分，添加到retrieved_nodes字典中
             retrieved_nodes.setdefault(label, []).extend(
                 # 对于非"Attr"标签，使用{标签名}_name作为键
@@ -301,7 +344,7 @@ class GraphRAG(InformationRetrieval):
                         f"{label.lower()}_name": i["node"][f"{label.lower()}_name"],
                         "score": i["score"],
                     }
-                    for i in result.records
+                    for i in records
                 ]
                 if label != "Attr"
                 # 对于"Attr"标签，使用{标签名}_value作为键
@@ -310,7 +353,7 @@ class GraphRAG(InformationRetrieval):
                         f"{label.lower()}_value": i["node"][f"{label.lower()}_value"],
                         "score": i["score"],
                     }
-                    for i in result.records
+                    for i in records
                 ]
             )
         logger.info("入口节点:%s", retrieved_nodes)
@@ -346,8 +389,8 @@ class GraphRAG(InformationRetrieval):
         # 1、验证 Cypher 语法
         errors = [] #错误列表，用于收集验证过程中发现的错误
         try:
-            self.driver.execute_query(f"explain {cypher}") #通过explain关键字只检查语法而不实际执行
-        except CypherSyntaxError as e: # 捕获语法错误并添加到错误列表中
+            await run_read(self.driver, f"explain {cypher}", timeout=self.query_timeout) #通过explain关键字只检查语法而不实际执行
+        except ClientError as e: # 捕获语法错误（以及只读会话中的写操作等）并添加到错误列表中
             errors.append(e)
 
         # 2、验证 Cypher 逻辑是否符合用户查询意图
@@ -400,12 +443,53 @@ class GraphRAG(InformationRetrieval):
             return SearchResultList.from_document_list([Document("空")])
         # 获取用户ID
         user_id = tracker_state.get("slots", {}).get("user_id")
+
+        # 查询缓存：先按规范化问题精确匹配，再按问题向量相似度匹配
+        # 追问的含义依赖上下文，不能只按问题匹配，路由后再按问题 + 路由结果精确匹配
+        follow_up = is_follow_up(tracker_state)
+        cache_entry = None
+        query_vector = None
+        if not follow_up:
+            cache_entry = self.cache.get_exact(query, user_id)
+            if cache_entry is None and self.cache.enabled:
+                try:
+                    query_vector = await asyncio.to_thread(self.embeddings.embed_query, query)
+                except Exception as e:
+                    logger.warning("问题向量化失败，跳过相似问题缓存: %s", e)
+                cache_entry = self.cache.get_similar(query, user_id, query_vector)
+        if cache_entry is not None:
+            return await self.cached_search(cache_entry)
+
         # 获取聊天历史
         chat_history = get_chat_history(tracker_state, user_id)
         # 获取入口节点标签
         route_res = await self.route_label(chat_history)
+        context = routing_context(route_res) if follow_up else None
+        if follow_up:
+            cache_entry = self.cache.get_exact(query, user_id, context)
+            if cache_entry is not None:
+                return await self.cached_search(cache_entry)
         # 检索入口节点
-        entry_nodes = await self.node_retrieval(route_res, 10)
+        top_matches = {}
+        entry_nodes = await self.node_retrieval(route_res, 10, top_matches)
+        # 缓存执行成功的 Cypher 语句；与用户相关的问题只对该用户缓存
+        scope = user_id if any(i.label == "User" for i in route_res) else None
+
+        # 常见问题形态直接套用 Cypher 模板，跳过 LLM 生成、验证和校正；模板查询无结果时仍走 LLM
+        template = self.templates.match(query, route_res, top_matches, user_id)
+        if template:
+            name, cypher, params = template
+            logger.info(
+                "Cypher模板命中(%s，覆盖率 %.0f%%):%s %s",
+                name, self.templates.coverage() * 100, cypher, params,
+            )
+            docs = await self.execute_cypher(cypher, params)
+            if docs:
+                self.cache.put(query, scope, cypher, query_vector, docs, params, context)
+                res = SearchResultList.from_document_list(docs)
+                logger.info("检索结果: %s", res)
+                return res
+            logger.info("Cypher模板无结果，改用 LLM 生成")
         # 生成 Cypher 语句
         cypher = await self.generate_cypher(query, entry_nodes)
         # 验证 Cyoher 语句
@@ -419,40 +503,57 @@ class GraphRAG(InformationRetrieval):
         # 执行 Cypher 语句
         # SearchResultList：rasa中一个专门用于存储搜索结果的类
         res = SearchResultList.from_document_list([Document("空")])
-        try:
-            records = self.driver.execute_query(cypher).records
-            docs = [Document(str(dict(rec))) for rec in records]
+        docs = await self.execute_cypher(cypher) if cypher else None
+        if docs is not None:
             res = SearchResultList.from_document_list(docs)
-        except Exception as e:
-            logger.warning("执行Cypher语句异常: %s", e)
+            if docs:  # 空结果不缓存，与模板路径一致
+                self.cache.put(query, scope, cypher, query_vector, docs, context=context)
         logger.info("检索结果: %s", res)
         return res
 
+    async def cached_search(self, cache_entry):
+        """缓存命中：返回未过期的缓存结果，否则重新执行缓存的 Cypher 语句"""
+        logger.info("缓存命中(%s):%s", cache_entry.query, cache_entry.cypher)
+        docs = cache_entry.cached_docs()
+        if docs is None:
+            docs = await self.execute_cypher(cache_entry.cypher, cache_entry.params)
+            if docs is not None:
+                self.cache.put_docs(cache_entry, docs)
+        res = SearchResultList.from_document_list(docs or [Document("空")])
+        logger.info("检索结果: %s", res)
+        return res
+
+    async def execute_cypher(self, cypher, params=None):
+        """执行 Cypher 语句，返回文档列表；执行异常或超时时返回 None"""
+        try:
+            records = await run_read(self.driver, cypher, params, self.query_timeout)
+            return [Document(str(dict(rec))) for rec in records]
+        except Exception as e:
+            logger.warning("执行Cypher语句异常: %s", e)
+            return None
+
 
 if __name__ == "__main__":
     # 检索测试
     import os
     from langchain_core.embeddings import Embeddings
-    from sentence_transformers import SentenceTransformer
+    from embed_client import get_embed_client
 
     neo4j_url = "neo4j://127.0.0.1"
     neo4j_auth = ("neo4j", "12345678")
 
 
     class BgeEmbedding(Embeddings):
-        """定义嵌入模型"""
+        """嵌入模型：调用嵌入服务，与 Rasa 运行时使用同一模型后端"""
 
         def __init__(self):
-            self.model = SentenceTransformer("../models/bge-base-zh-v1.5")
+            self.client = get_embed_client()
 
         def embed_query(self, text: str) -> list[float]:
             return self.embed_documents([text])[0]
 
         def embed_documents(self, texts: list[str]) -> list[list[float]]:
-            embeddings = self.model.encode(
-                texts, batch_size=64, normalize_embeddings=True
-            )
-            return [list(map(float, emb)) for emb in embeddings]
+            return self.client.encode(texts).tolist()
 
 
     async def test_retrieval(query):
@@ -0,0 +1,168 @@
+"""
+GraphRAG 检索结果的两级缓存：命中后跳过 路由 -> 生成 -> 验证 -> 校正 整条 LLM 链路。
+    一级：规范化问题 + 用户范围 精确匹配
+    二级：问题嵌入向量余弦相似度不低于阈值，且问题的关键词（领域词典分词结果去掉通用词）完全一致
+缓存内容为最终校正后的 Cypher 语句（或模板 Cypher 及参数），可选缓存执行结果（单独的较短 TTL，过期后只重新执行 Cypher）。
+与用户相关的问题（路由结果包含 User 节点）只在该用户范围内命中，其余问题所有用户共享。
+含义依赖上下文的追问（如“那白色的呢”）由调用方传入 context（路由出的标签和实体），只做一级匹配。
+"""
+
+import time
+import unicodedata
+from dataclasses import dataclass
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    from addons.tokenization import tokenize
+except ImportError:  # 在 addons 目录下直接运行时
+    from tokenization import tokenize
+
+# 不影响查询内容的通用词，比较关键词时忽略
+stop_words = frozenset(
+    "的 了 呢 吗 吧 啊 呀 我 你 帮 帮我 给 给我 请 请问 想 想要 要 找 找找 看 看看 推荐 一下 一款 一个 有 有没有 "
+    "哪些 哪个 哪款 什么 都 是 还 也 和 与 或 有哪些 能 可以 麻烦 商品 产品 东西".split()
+)
+
+
+def normalize_query(query):
+    """规范化问题：全角转半角、转小写，只保留字母数字和中文（去掉空白与标点）"""
+    text = unicodedata.normalize("NFKC", query).lower()
+    return "".join(ch for ch in text if ch.isalnum())
+
+
+def key_terms(normalized):
+    """
+    问题的关键词：与全文索引相同的领域词典分词结果，去掉通用词。
+    二级匹配要求完全一致，避免“oppo 手机”命中“vivo 手机”、“白色手机”命中“黑色手机”、“手机”命中“平板”
+    """
+    return frozenset(tokenize(normalized)) - stop_words
+
+
+@dataclass
+class CacheEntry:
+    scope: str | None  # 用户ID；None 表示所有用户共享
+    query: str  # 规范化问题
+    context: str | None  # 追问的路由上下文；None 表示问题本身含义完整
+    terms: frozenset  # 关键词，二级匹配使用
+    cypher: str
+    vector: np.ndarray | None
+    expires_at: float
+    params: dict | None = None  # 模板 Cypher 的参数
+    docs: list | None = None
+    docs_expire_at: float = 0.0
+
+    def cached_docs(self):
+        """未过期的缓存结果，没有则返回 None"""
+        if self.docs is not None and time.monotonic() < self.docs_expire_at:
+            return self.docs
+        return None
+
+
+class SemanticCache:
+    """
+    进程内缓存，LRU 淘汰：
+        max_entries: 最多缓存的问题数
+        ttl_s: Cypher 语句的有效期（图谱 schema 或数据大改后应重启或调小）
+        similarity_threshold: 二级匹配的余弦相似度阈值
+        cache_results: 是否同时缓存执行结果
+        result_ttl_s: 执行结果的有效期
+    """
+
+    def __init__(
+        self,
+        enabled=True,
+        max_entries=1000,
+        ttl_s=3600,
+        similarity_threshold=0.95,
+        cache_results=True,
+        result_ttl_s=300,
+    ):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.similarity_threshold = similarity_threshold
+        self.cache_results = cache_results
+        self.result_ttl_s = result_ttl_s
+        self.entries = OrderedDict()  # (scope, 规范化问题, 路由上下文) -> CacheEntry
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+
+    def _alive(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() >= entry.expires_at:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def get_exact(self, query, user_id, context=None):
+        """一级：先查用户范围，再查共享范围；追问需传入相同的路由上下文才命中"""
+        if not self.enabled:
+            return None
+        normalized = normalize_query(query)
+        for scope in (user_id, None):
+            entry = self._alive((scope, normalized, context))
+            if entry:
+                self.hits["exact"] += 1
+                return entry
+        return None
+
+    def get_similar(self, query, user_id, vector):
+        """二级：在用户范围和共享范围的条目中找相似度最高且英文/数字词一致的问题"""
+        if not self.enabled:
+            return None
+        if vector is None:
+            self.misses += 1
+            return None
+        terms = key_terms(normalize_query(query))
+        vector = np.asarray(vector, dtype=np.float32)
+        best, best_score = None, self.similarity_threshold
+        for key, entry in list(self.entries.items()):
+            if entry.scope not in (user_id, None) or entry.vector is None or entry.context is not None:
+                continue
+            if entry.terms != terms:
+                continue
+            score = float(entry.vector @ vector)
+            if score >= best_score and self._alive(key):
+                best, best_score = entry, score
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits["semantic"] += 1
+        return best
+
+    def put(self, query, scope, cypher, vector=None, docs=None, params=None, context=None):
+        """缓存最终的 Cypher 语句（和执行结果）；向量需已归一化，追问（context 不为空）不参与二级匹配"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        normalized = normalize_query(query)
+        entry = CacheEntry(
+            scope=scope,
+            query=normalized,
+            context=context,
+            terms=key_terms(normalized),
+            cypher=cypher,
+            vector=None if vector is None else np.asarray(vector, dtype=np.float32),
+            expires_at=now + self.ttl_s,
+            params=params,
+        )
+        key = (scope, normalized, context)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if docs is not None:
+            self.put_docs(entry, docs)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def put_docs(self, entry, docs):
+        if self.cache_results:
+            entry.docs = docs
+            entry.docs_expire_at = time.monotonic() + self.result_ttl_s
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": dict(self.hits), "misses": self.misses}
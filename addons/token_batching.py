@@ -0,0 +1,75 @@
+"""
+按 token 预算分批编码。
+先按分词后的长度排序，再按“批内最长长度 × 批大小 ≤ token 预算”组批，长度相近的文本进同一批，
+短文本（如“蓝色”）不再被长 SKU 标题撑大 padding；编码结果按原始顺序返回。
+"""
+
+import numpy as np
+
+
+def token_lengths(model, texts: list[str]) -> list[int]:
+    """计算每条文本分词后的长度（含特殊 token，超过模型最大长度的按截断计）"""
+    tokenized = model.tokenizer(
+        list(texts),
+        add_special_tokens=True,
+        truncation=True,
+        max_length=model.max_seq_length,
+    )
+    return [len(ids) for ids in tokenized["input_ids"]]
+
+
+def token_budget_batches(
+    lengths: list[int], max_tokens: int, max_batch_size: int | None = None
+) -> list[list[int]]:
+    """
+    按长度升序组批，返回每批的原始下标列表。
+        max_tokens: 每批 padding 后的 token 总数上限（批大小 × 批内最长长度）
+        max_batch_size: 可选的每批条数上限
+    单条文本超过预算时独占一批。
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches, batch = [], []
+    for i in order:
+        # 升序遍历，当前文本即为加入后批内最长的文本
+        if batch and (
+            lengths[i] * (len(batch) + 1) > max_tokens
+            or (max_batch_size and len(batch) >= max_batch_size)
+        ):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def padding_ratio(lengths: list[int], batches: list[list[int]]) -> float:
+    """padding token 占全部计算 token 的比例，用于观察组批效果"""
+    total = sum(max(lengths[i] for i in batch) * len(batch) for batch in batches)
+    return 1 - sum(lengths) / total if total else 0.0
+
+
+def encode_by_token_budget(
+    model,
+    texts: list[str],
+    max_tokens: int,
+    normalize_embeddings: bool = True,
+    max_batch_size: int | None = None,
+) -> np.ndarray:
+    """按 token 预算分批调用 model.encode，返回与 texts 顺序一致的向量矩阵"""
+    if not texts:
+        return np.empty((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    lengths = token_lengths(model, texts)
+    embeddings = None
+    for batch in token_budget_batches(lengths, max_tokens, max_batch_size):
+        batch_embeddings = model.encode(
+            [texts[i] for i in batch],
+            batch_size=len(batch),
+            normalize_embeddings=normalize_embeddings,
+        )
+        if embeddings is None:
+            embeddings = np.empty(
+                (len(texts), batch_embeddings.shape[1]), dtype=batch_embeddings.dtype
+            )
+        embeddings[batch] = batch_embeddings
+    return embeddings
@@ -0,0 +1,156 @@
+"""
+中文分词：全文索引构建和检索共用。
+从图谱中的品牌、SPU、分类名称生成 jieba 领域词典（如“金沙河”“索芙特”不再被切开），
+与 jieba 默认词典合并后由 jieba 编译为前缀词典缓存在 models/jieba 下，之后加载只需读取缓存；
+大批量文本在多进程池中分词。
+"""
+
+import os
+import re
+import atexit
+import hashlib
+import logging
+import threading
+import multiprocessing
+from pathlib import Path
+
+import jieba
+
+logger = logging.getLogger("tokenization")
+
+# 只保留英文字母、数字和中文字符组成的词
+token_pattern = re.compile(r"[a-zA-Z0-9\u4e00-\u9fa5]+")
+# 领域词典来源：节点标签及其名称属性
+dictionary_sources = [
+    ("Trademark", "trademark_name"),
+    ("SPU", "spu_name"),
+    ("Category1", "category1_name"),
+    ("Category2", "category2_name"),
+    ("Category3", "category3_name"),
+]
+dict_dir = Path(__file__).resolve().parent.parent / "models" / "jieba"
+max_word_length = 10  # 超过该长度的名称片段（多为整句商品标题）不作为词条，避免粘连成一个词
+pool_min_texts = 2000  # 文本数不少于该值时才使用进程池
+pool_chunk_size = 500  # 每个子进程任务的文本数
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+_pool = None
+_pool_processes = 0
+
+
+def _domain_words(names):
+    """从名称中切出候选词：按非中英文数字字符切分，保留含中文且长度合适的片段"""
+    words = set()
+    for name in names:
+        for chunk in token_pattern.findall(name or ""):
+            if 2 <= len(chunk) <= max_word_length and re.search(r"[\u4e00-\u9fa5]", chunk):
+                words.add(chunk)
+    return sorted(words)
+
+
+def build_user_dict(driver):
+    """
+    从图谱生成领域词典，写入 dict_dir：
+        userdict.txt: 领域词条及词频，词典内容变化即视为分词规则变化
+        dict.txt: jieba 默认词典 + 领域词条，作为分词器的主词典，jieba 首次加载时在同目录生成编译缓存
+    词频取 jieba 建议的最小词频（保证整词不被切开），默认词典中已有且词频足够的词不重复写入。
+    """
+    global _tokenizer
+    names = []
+    for label, property in dictionary_sources:
+        records = driver.execute_query(
+            f"match (n:{label}) where n.{property} is not null return n.{property} as name"
+        ).records
+        names.extend(r["name"] for r in records)
+
+    base = jieba.Tokenizer()
+    base.initialize()
+    entries = []
+    for word in _domain_words(names):
+        freq = base.suggest_freq(word, tune=False)
+        if freq > base.FREQ.get(word, 0):
+            entries.append(f"{word} {freq}\n")
+
+    dict_dir.mkdir(parents=True, exist_ok=True)
+    user_tmp = dict_dir / "userdict.txt.tmp"
+    merged_tmp = dict_dir / "dict.txt.tmp"
+    user_tmp.write_text("".join(entries), encoding="utf-8")
+    with jieba.get_dict_file() as default_dict, open(merged_tmp, "wb") as merged:
+        merged.write(default_dict.read().rstrip(b"\n") + b"\n")
+        merged.write("".join(entries).encode("utf-8"))
+    # 先写临时文件再替换，避免检索服务读到写了一半的词典
+    os.replace(user_tmp, dict_dir / "userdict.txt")
+    os.replace(merged_tmp, dict_dir / "dict.txt")
+    with _tokenizer_lock:
+        _tokenizer = None
+    logger.info(f"领域词典已生成：{len(entries)} 个词条，{dict_dir}")
+
+
+def dictionary_version():
+    """领域词典的版本（内容哈希），未生成领域词典时为 default"""
+    path = dict_dir / "userdict.txt"
+    if not path.exists():
+        return "default"
+    return hashlib.sha1(path.read_bytes()).hexdigest()[:12]
+
+
+def get_tokenizer():
+    """加载分词器：有领域词典时使用合并后的词典，编译缓存保存在 dict_dir，之后加载直接读缓存"""
+    global _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is None:
+            merged = dict_dir / "dict.txt"
+            tokenizer = jieba.Tokenizer(str(merged) if merged.exists() else jieba.DEFAULT_DICT)
+            if merged.exists():
+                tokenizer.tmp_dir = str(dict_dir)
+            tokenizer.initialize()
+            _tokenizer = tokenizer
+        return _tokenizer
+
+
+def tokenize(text):
+    """分词，只保留中英文和数字组成的词"""
+    return [
+        word.strip()
+        for word in get_tokenizer().lcut(text)
+        if token_pattern.fullmatch(word.strip())
+    ]
+
+
+def _tokenize_chunk(texts):
+    return [tokenize(text) for text in texts]
+
+
+def _get_pool(processes):
+    global _pool, _pool_processes
+    if _pool is None or _pool_processes != processes:
+        if _pool is not None:
+            _pool.close()
+        # spawn：调用方（如索引流水线）可能有其他线程在运行，避免 fork 带来的锁状态问题
+        ctx = multiprocessing.get_context("spawn")
+        _pool = ctx.Pool(processes, initializer=get_tokenizer)
+        _pool_processes = processes
+    return _pool
+
+
+@atexit.register
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+        _pool = None
+
+
+def tokenize_many(texts, processes=None):
+    """
+    批量分词，结果与 texts 顺序一致。
+    processes: 进程数，默认 CPU 核数；为 1 或文本数少于 pool_min_texts 时在当前进程分词
+    """
+    texts = list(texts)
+    processes = processes or os.cpu_count() or 1
+    if processes <= 1 or len(texts) < pool_min_texts:
+        return _tokenize_chunk(texts)
+    chunks = [texts[i: i + pool_chunk_size] for i in range(0, len(texts), pool_chunk_size)]
+    return [tokens for part in _get_pool(processes).map(_tokenize_chunk, chunks) for tokens in part]
@@ -0,0 +1,160 @@
+"""
+入口节点向量检索的进程内镜像：目录向量在两次重建索引之间不变，
+create_indexing.py 建完索引后把各标签节点的 embedding 属性导出为 float32 行矩阵，
+检索进程内存映射后分块做内积检索，不再为每个实体请求 Neo4j 向量索引。
+目录结构（mirror_dir）：
+    version.json            版本标记 {"version", "model", "dim", "labels": {标签: 行数}}，最后写入
+    <version>/<标签>.f32    已归一化的嵌入向量，每行一个节点
+    <version>/<标签>.ids    每行对应节点的 elementId
+检索进程定期检查版本标记，变化后加载新版本；镜像中没有的标签仍走 Neo4j 向量索引。
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import logging
+import threading
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger("vector_mirror")
+
+mirror_dir = Path(__file__).resolve().parent.parent / "output" / "vector_mirror"
+search_block_rows = 65536  # 分块检索每块的行数，控制内积矩阵的临时内存
+
+
+def export_vector_mirror(driver, labels, model, dim, out_dir=mirror_dir):
+    """
+    导出各标签节点的 (elementId, 嵌入向量) 到新的版本目录，最后替换版本标记；
+    保留上一个版本目录，供正在加载旧版本的检索进程使用，更早的版本删除。
+    """
+    out_dir = Path(out_dir)
+    version = time.strftime("%Y%m%d%H%M%S") + "-" + uuid.uuid4().hex[:8]
+    version_dir = out_dir / version
+    version_dir.mkdir(parents=True)
+    counts = {}
+    with driver.session() as session:
+        for label in labels:
+            # 逐条流式读取，不把整个标签的向量读入内存
+            result = session.run(
+                f"match (n:{label}) where n.embedding is not null "
+                "return elementId(n) as id, n.embedding as embedding"
+            )
+            rows = 0
+            with open(version_dir / f"{label}.f32", "wb") as vf, open(version_dir / f"{label}.ids", "w") as xf:
+                for record in result:
+                    vf.write(np.asarray(record["embedding"], dtype="<f4").tobytes())
+                    xf.write(record["id"] + "\n")
+                    rows += 1
+            counts[label] = rows
+            logger.info(f"导出 {label} ({rows}) 的向量镜像")
+
+    marker_tmp = out_dir / "version.json.tmp"
+    marker_tmp.write_text(
+        json.dumps({"version": version, "model": model, "dim": dim, "labels": counts}, ensure_ascii=False)
+    )
+    os.replace(marker_tmp, out_dir / "version.json")
+    previous = sorted(
+        (p for p in out_dir.iterdir() if p.is_dir() and p.name != version), key=lambda p: p.stat().st_mtime
+    )
+    for path in previous[:-1]:
+        shutil.rmtree(path, ignore_errors=True)
+    logger.info(f"向量镜像已导出到 {version_dir}")
+
+
+class VectorMirror:
+    """
+    检索进程中的向量镜像，线程安全：
+        directory: 镜像目录（export_vector_mirror 的 out_dir）
+        check_interval_s: 检查版本标记的最小间隔（秒）
+    """
+
+    def __init__(self, directory=mirror_dir, check_interval_s=30):
+        self.directory = Path(directory)
+        self.check_interval_s = check_interval_s
+        self.version = None
+        self.labels = {}  # 标签 -> (向量矩阵 memmap, elementId 列表)
+        self.checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """版本标记变化时加载新版本；标记不存在或读取失败时保留当前版本"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self.checked_at < self.check_interval_s:
+                return
+            self.checked_at = now
+            try:
+                meta = json.loads((self.directory / "version.json").read_text())
+            except (OSError, ValueError):
+                return
+            if meta["version"] == self.version:
+                return
+            labels = {}
+            version_dir = self.directory / meta["version"]
+            try:
+                for label, rows in meta["labels"].items():
+                    if not rows:
+                        continue
+                    matrix = np.memmap(
+                        version_dir / f"{label}.f32", dtype="<f4", mode="r", shape=(rows, meta["dim"])
+                    )
+                    ids = (version_dir / f"{label}.ids").read_text().splitlines()
+                    labels[label] = (matrix, ids)
+            except OSError as e:
+                logger.warning(f"加载向量镜像 {meta['version']} 失败，继续使用当前版本：{e}")
+                return
+            # 整体替换，正在检索的线程仍使用旧版本的引用
+            self.labels, self.version = labels, meta["version"]
+            logger.info(f"加载向量镜像 {meta['version']}（{meta.get('model')}）：{sorted(labels)}")
+
+    def search(self, label, vectors, k):
+        """
+        分块内积检索，返回每个查询向量得分最高的 k 个节点 [{"id": elementId, "score": 得分}]；
+        得分换算为 Neo4j 余弦向量索引的 (1 + cos) / 2。标签不在镜像中时返回 None
+        """
+        entry = self.labels.get(label)
+        if entry is None:
+            return None
+        matrix, ids = entry
+        queries = np.asarray(vectors, dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        k = min(k, len(ids))
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(ids), search_block_rows):
+            block = np.asarray(matrix[start: start + search_block_rows])
+            scores = np.concatenate([best_scores, queries @ block.T], axis=1)
+            rows = np.concatenate(
+                [best_rows, np.broadcast_to(np.arange(start, start + len(block)), (len(queries), len(block)))],
+                axis=1,
+            )
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, top, axis=1)
+                rows = np.take_along_axis(rows, top, axis=1)
+            best_scores, best_rows = scores, rows
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        return [
+            [{"id": ids[r], "score": float((1 + s) / 2)} for r, s in zip(row_ids, row_scores)]
+            for row_ids, row_scores in zip(best_rows, best_scores)
+        ]
+
+    def search_many(self, labels, vectors, k):
+        """按标签分组检索，返回与输入顺序一致的结果；镜像中没有的标签对应 None"""
+        self.refresh()
+        results = [None] * len(labels)
+        groups = {}
+        for i, label in enumerate(labels):
+            groups.setdefault(label, []).append(i)
+        for label, positions in groups.items():
+            hits = self.search(label, [vectors[i] for i in positions], k)
+            if hits is not None:
+                for i, h in zip(positions, hits):
+                    results[i] = h
+        return results
@@ -47,6 +47,25 @@ finally:
 PY
 }
 
+# 等待嵌入服务就绪（模型加载并预热完成，/readyz 返回 200），端口可连不代表可以接收流量
+wait_ready() {
+  python - "$1" "$2" "$3" <<'PY'
+import sys, time, urllib.request, urllib.error
+host, port, timeout = sys.argv[1], int(sys.argv[2]), float(sys.argv[3])
+host = "127.0.0.1" if host == "0.0.0.0" else host
+deadline = time.time() + timeout
+while time.time() < deadline:
+    try:
+        with urllib.request.urlopen(f"http://{host}:{port}/readyz", timeout=2) as resp:
+            print(resp.read().decode())
+            sys.exit(0)
+    except (urllib.error.URLError, OSError):
+        time.sleep(1)
+sys.exit(1)
+PY
+}
+
+EMBED_READY_TIMEOUT="${EMBED_READY_TIMEOUT:-300}"
 EMBED_PID=""
 if check_port "${EMBED_HOST}" "${EMBED_PORT}"; then
   echo "[INFO] 嵌入服务已在 ${EMBED_HOST}:${EMBED_PORT} 监听，跳过启动。"
@@ -58,6 +77,13 @@ else
   echo "[INFO] 嵌入服务 PID=${EMBED_PID} 日志: ${LOG_DIR}/embed_service.log"
 fi
 
+echo "[INFO] 等待嵌入服务就绪（最长 ${EMBED_READY_TIMEOUT}s）..."
+if ! wait_ready "${EMBED_HOST}" "${EMBED_PORT}" "${EMBED_READY_TIMEOUT}"; then
+  echo "[ERROR] 嵌入服务未在 ${EMBED_READY_TIMEOUT}s 内就绪，请查看 ${LOG_DIR}/embed_service.log" >&2
+  kill ${EMBED_PID:-} 2>/dev/null || true
+  exit 1
+fi
+
 echo "[INFO] 启动 Action Server (日志: ${LOG_DIR}/rasa_actions.log)..."
 nohup rasa run actions --debug \
   > "${LOG_DIR}/rasa_actions.log" 2>&1 &